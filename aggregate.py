@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Incremental sweep statistics, updated as jobs finish.
+
+Each finished (run_index, repeat_index) is processed exactly once and
+folded into running statistics per sweep point (run index), which are kept
+in aggregate.db next to run_info. Jobs are finished when the manifest says
+so, or, for sweeps without a manifest, when their table has not changed
+for a while. A snapshot of the statistics can be printed at any time.
+"""
+import os
+import io
+import time
+import asyncio
+import sqlite3
+import multiprocessing
+import numpy as np
+from mx3util import RunInfo, match_vars
+from statestream import load_state_keys
+from states import repeat_stats
+from complexity_analysis import table_complexity
+from monitor import wait_for_change
+
+AGGREGATE_FILENAME = 'aggregate.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS processed (
+    run_index INTEGER NOT NULL,
+    repeat_index INTEGER NOT NULL,
+    time REAL,
+    PRIMARY KEY (run_index, repeat_index)
+);
+CREATE TABLE IF NOT EXISTS points (
+    run_index INTEGER PRIMARY KEY,
+    states BLOB,
+    final_states BLOB
+);
+CREATE TABLE IF NOT EXISTS moments (
+    run_index INTEGER NOT NULL,
+    stat TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    m2 REAL NOT NULL,
+    PRIMARY KEY (run_index, stat)
+);
+'''
+
+# Statistics of a single repeat, averaged over repeats with mean and std.
+# state_diff and final_len are those of states.py, complexity that of
+# complexity_analysis.py
+MOMENT_STATS = ['complexity', 'state_diff', 'final_len']
+
+def to_blob(a):
+    f = io.BytesIO()
+    np.save(f, a)
+    return f.getvalue()
+
+def from_blob(b):
+    return np.load(io.BytesIO(b))
+
+def union_keys(a, b):
+    if a is None:
+        return b
+    return np.unique(np.concatenate([a, b]), axis=0)
+
+def summarize_repeat(job):
+    """ Worker: statistics of one finished table, or None if it cannot be read """
+    (i, j), tablefile, variables, spp, skip, compression = job
+    try:
+        K = load_state_keys(tablefile, variables, spp, skip)
+        if len(K) == 0:
+            return (i, j), None
+        summary = repeat_stats(K)
+    except (OSError, ValueError, KeyError):
+        return (i, j), None
+
+    try:
+        # Shares the cache of complexity_analysis.py
+        summary['complexity'], _ = table_complexity(tablefile, compression)
+    except KeyError:
+        # Not a table of the magnets complexity_analysis.py looks at
+        summary['complexity'] = np.nan
+    except (OSError, ValueError):
+        return (i, j), None
+
+    return (i, j), summary
+
+class Aggregator(object):
+    """ Running per sweep point statistics of a sweep, persisted in SQLite """
+    def __init__(self, run, filename=None, variables=None, spp=100, skip=0, compression='bz2'):
+        self.run = run
+        if filename is None:
+            filename = os.path.join(run.basedir, AGGREGATE_FILENAME)
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+
+        params = {'variables': repr(variables), 'spp': spp, 'skip': skip, 'compression': compression}
+        stored = dict(self.db.execute('SELECT key, value FROM info'))
+        if stored and stored != params:
+            raise ValueError("{} was made with {}, remove it to start over".format(filename, stored))
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO info VALUES (?, ?)', params.items())
+
+        self.patterns = variables or ['m*']
+        self.variables = None
+        self.spp = spp
+        self.skip = skip
+        self.compression = compression
+
+    def close(self):
+        self.db.close()
+
+    def processed(self):
+        return set(self.db.execute('SELECT run_index, repeat_index FROM processed'))
+
+    def finished(self, settle=60):
+        """ Finished jobs as (run_index, repeat_index) """
+        if self.run.manifest:
+            return set(self.run.manifest.query('finished'))
+
+        # Without a manifest, a table is complete once it stops changing
+        finished = set()
+        now = time.time()
+        for i in range(self.run.run_count):
+            for j in range(self.run.repeat_count(i)):
+                try:
+                    st = os.stat(self.run.get_table_filename(i, j))
+                except OSError:
+                    continue
+                if now - st.st_mtime >= settle:
+                    finished.add((i, j))
+        return finished
+
+    def failed(self):
+        """ Jobs that failed for good, never processed """
+        if self.run.manifest:
+            return set(self.run.manifest.query('failed'))
+        return set()
+
+    def active(self):
+        """ Whether jobs may still finish, always without a manifest to tell """
+        if self.run.manifest:
+            return bool(self.run.manifest.query('queued') or self.run.manifest.query('running'))
+        return True
+
+    def pending(self, settle=60):
+        return sorted(self.finished(settle) - self.processed())
+
+    def add(self, i, j, summary):
+        """ Fold the statistics of repeat j of run i into run i, exactly once """
+        if summary is None:
+            # Unreadable table (still being written?), retried on the next update
+            return False
+
+        with self.db:
+            cur = self.db.execute('INSERT OR IGNORE INTO processed VALUES (?, ?, ?)',
+                    (i, j, time.time()))
+            if cur.rowcount == 0:
+                return False
+
+            row = self.db.execute('SELECT states, final_states FROM points WHERE run_index = ?',
+                    (i,)).fetchone()
+            states, final_states = (None, None) if row is None else map(from_blob, row)
+            states = union_keys(states, summary['states'])
+            final_states = union_keys(final_states, summary['final_state'])
+            self.db.execute('INSERT OR REPLACE INTO points VALUES (?, ?, ?)',
+                    (i, to_blob(states), to_blob(final_states)))
+
+            # Welford's online mean and variance
+            for stat in MOMENT_STATS:
+                x = float(summary[stat])
+                if np.isnan(x):
+                    # Not available for this table
+                    continue
+                row = self.db.execute('SELECT n, mean, m2 FROM moments WHERE run_index = ? AND stat = ?',
+                        (i, stat)).fetchone()
+                n, mean, m2 = row if row else (0, 0.0, 0.0)
+                n += 1
+                delta = x - mean
+                mean += delta / n
+                m2 += delta * (x - mean)
+                self.db.execute('INSERT OR REPLACE INTO moments VALUES (?, ?, ?, ?, ?)',
+                        (i, stat, n, mean, m2))
+        return True
+
+    def update(self, processes=None, settle=60):
+        """ Process all newly finished jobs, returns the number processed """
+        pending = self.pending(settle)
+        if not pending:
+            return 0
+
+        if self.variables is None:
+            i, j = pending[0]
+            self.variables = match_vars(self.patterns, self.run.get_header(i, j))
+
+        jobs = [((i, j), self.run.get_table_filename(i, j), self.variables, self.spp, self.skip,
+                 self.compression) for i, j in pending]
+        n = 0
+        unreadable = []
+        with multiprocessing.Pool(processes) as pool:
+            for (i, j), summary in pool.imap_unordered(summarize_repeat, jobs):
+                if summary is None:
+                    unreadable.append((i, j))
+                elif self.add(i, j, summary):
+                    n += 1
+        if unreadable:
+            print("Could not read {} tables, will retry: {}".format(len(unreadable), sorted(unreadable)))
+        return n
+
+    def snapshot(self):
+        """ Current statistics as (column names, one row per sweep point) """
+        stats = ['repeats', 'state_count', 'final_count']
+        for stat in MOMENT_STATS:
+            stats.extend([stat, stat + '_std'])
+
+        rows = np.full((self.run.run_count, len(stats)), np.nan)
+        for i, states, final_states in self.db.execute('SELECT run_index, states, final_states FROM points'):
+            rows[i, 1] = len(from_blob(states))
+            rows[i, 2] = len(from_blob(final_states))
+        for i, stat, n, mean, m2 in self.db.execute('SELECT run_index, stat, n, mean, m2 FROM moments'):
+            k = stats.index(stat)
+            rows[i, 0] = np.fmax(rows[i, 0], n)
+            rows[i, k] = mean
+            rows[i, k + 1] = np.sqrt(m2 / n)
+        return stats, rows
+
+def sweep_values(run):
+    """ Values of the (first) swept parameter, or run indices """
+    try:
+        sweep_spec = run['sweep_spec']
+        return sweep_spec[0][0][0], [sp[1] for sp in sweep_spec[0]]
+    except (KeyError, IndexError, TypeError):
+        return 'run_index', list(range(run.run_count))
+
+def print_snapshot(agg, dump=None):
+    stats, rows = agg.snapshot()
+    param, values = sweep_values(agg.run)
+    if len(values) != len(rows):
+        param, values = 'run_index', list(range(len(rows)))
+
+    n_jobs = sum(agg.run.repeat_counts())
+    n_failed = len(agg.failed())
+    print("{}: {}/{} jobs processed{}".format(time.asctime(), len(agg.processed()), n_jobs,
+          ", {} failed".format(n_failed) if n_failed else ""))
+    print(" ".join("{:>12}".format(s[:12]) for s in [param] + stats))
+    for value, row in zip(values, rows):
+        print(" ".join("{:>12.6g}".format(v) for v in [value] + list(row)))
+
+    if dump:
+        tmp = '{}.{}.tmp'.format(dump, os.getpid())
+        np.savetxt(tmp, np.column_stack([values, rows]), header=", ".join([param] + stats))
+        os.replace(tmp, dump)
+
+def main(args):
+    run = RunInfo(args.filename, load=True)
+    agg = Aggregator(run, args.output, args.variables, args.spp, args.skip, args.compression)
+
+    n_jobs = sum(run.repeat_counts())
+    while True:
+        # Checked first so that jobs finishing during the update are not missed
+        active = agg.active()
+        n = agg.update(args.jobs, args.settle)
+        if n or not args.watch:
+            print_snapshot(agg, args.dump)
+        # Failed jobs will not be processed, stop once nothing else can finish
+        if not args.watch or not active or len(agg.processed() | agg.failed()) >= n_jobs:
+            break
+        # Wake up early when the sweep directory changes
+        asyncio.run(wait_for_change(run.basedir, args.watch))
+
+    agg.close()
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v', '--variables', nargs='+', default=None,
+            help='variables to digitize (default: m*)')
+    parser.add_argument('-s', '--spp', type=int, default=100,
+            help='Samples per period')
+    parser.add_argument('-k', '--skip', type=float, default=0,
+            help='Periods to skip')
+    parser.add_argument('-c', '--compression', choices=('zlib', 'bz2', 'lz76', 'entropy'), default='bz2',
+            help='complexity measure, as in complexity_analysis.py (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='number of parallel processes (default: number of CPUs)')
+    parser.add_argument('-w', '--watch', type=float, metavar='SECONDS', default=None,
+            help='keep processing jobs as they finish, checking at least every SECONDS')
+    parser.add_argument('--settle', type=float, default=60,
+            help='without a manifest, seconds a table must be unchanged to be complete (default: %(default)s)')
+    parser.add_argument('-o', '--output', metavar='FILE',
+            help='statistics store (default: {} next to run_info)'.format(AGGREGATE_FILENAME))
+    parser.add_argument('--dump', metavar='FILE', help='Save snapshot to text file')
+    parser.add_argument('filename', help='run_info file')
+
+    args = parser.parse_args()
+    main(args)
@@ -73,7 +73,7 @@ def fig_graphs():
         ]
 
     for filename, run_index, out in zip(filenames, run_indices, outputs):
-        G = load_graph(filename, variables, spp=100, skip=0, run_index=run_index)
+        G = load_graph(filename, variables, spp=100, skip=0, run_index=run_index).to_networkx()
         label_nodes(G, False, False)
         color_nodes(G)
 
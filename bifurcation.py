@@ -2,46 +2,47 @@
 # -*- coding: utf-8 -*-
 import os
 import pickle
+import multiprocessing
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
 from itertools import cycle
-from mx3util import parse_table_header, load_table, match_vars
+from mx3util import RunInfo, get_tablefile, load_poincare, count_rows, match_vars
+
+# Points binned at a time by bfd_raster
+RASTER_BLOCK_POINTS = 1 << 22
 
 def run_load_sweep(sweep_data, suptitle=None):
     for data in sweep_data['sweep_data']:
         run_load_single(data, suptitle)
 
-def load_run_info(filename):
-    return pickle.load(open(args.filename, "rb"), encoding='latin1')
-
-def poincare(X, step, skip=10):
-    step = int(step)
-    skip = int(skip * step)
-    return X[skip::step]
-
-def get_tablefile(mx3_filename):
-    base, _ = os.path.splitext(mx3_filename)
-    basedir = os.path.dirname(mx3_filename)
-    outdir = os.path.join(basedir, base + ".out")
-    tablefile = os.path.join(outdir, "table.txt")
-    return tablefile
-
 def load_bfd(mx3_filename, variables, spp=1000, skip=1):
     tablefile = get_tablefile(mx3_filename)
+    return load_bfd_table(tablefile, variables, spp, skip)
 
-    X = load_table(tablefile, variables)
-    if len(variables) == 1:
-        X.shape += (1,)
+def bfd_rows(tablefile, spp=1000, skip=1):
+    """ Rows of a table that are bifurcation points, as a range """
+    # Only whole periods are used
+    n_periods = int(count_rows(tablefile) / spp)
+    assert skip < n_periods, "{}: Not enough periods ({}) to skip {}".format(tablefile, n_periods, skip)
+    return range(int(skip * spp), n_periods * spp, spp)
 
-    n_periods = int(X.shape[0] / spp)
-    X = X[:n_periods * spp] # truncate
+def load_bfd_table(tablefile, variables, spp=1000, skip=1):
     step = spp
-    assert skip < n_periods, "{}: Not enough periods ({}) to skip {}".format(tablefile, n_periods, skip)
+    rows = bfd_rows(tablefile, spp, skip)
 
-    PX = poincare(X, step, skip)
+    PX = load_poincare(tablefile, variables, step, skip, stop=rows.stop)
 
     return PX
 
+def count_bfd_points(job):
+    """ Worker: number of bifurcation points of a table, 0 if it is missing """
+    tablefile, spp, skip = job
+    try:
+        return len(bfd_rows(tablefile, spp, skip))
+    except FileNotFoundError:
+        return 0
+
 def bfd_plot(bf_param, bf_range, bfd, ylabel="x", title=None, suptitle=None, ylim=None, **kwargs):
     plt.figure()
     if title:
@@ -55,54 +56,118 @@ def bfd_plot(bf_param, bf_range, bfd, ylabel="x", title=None, suptitle=None, yli
     plt.xlabel(bf_param)
     plt.ylabel(ylabel)
 
+def sweep_edges(values):
+    """ Pixel edges centered on each (sorted) sweep value """
+    values = np.asarray(values, dtype=float)
+    if len(values) == 1:
+        return values + [-0.5, 0.5]
+    mid = (values[1:] + values[:-1]) / 2
+    return np.concatenate([[2 * values[0] - mid[0]], mid, [2 * values[-1] - mid[-1]]])
+
+def bfd_raster(bfd, ylim, bins=500):
+    """ Count points of bfd (n_sweep, n_points) in bins along y, one column per sweep value
+
+    NaN points and points outside ylim are ignored. Returns (n_sweep, bins) counts.
+    """
+    n_sweep, n_points = bfd.shape
+    ymin, ymax = ylim
+    scale = bins / (ymax - ymin)
+    H = np.zeros((n_sweep, bins), dtype=np.int64)
+    # Same as np.histogram2d with one x bin per row, but O(n) in the number
+    # of points, in blocks of rows to bound the size of temporaries
+    block = max(1, RASTER_BLOCK_POINTS // max(n_points, 1))
+    for start in range(0, n_sweep, block):
+        Y = np.asarray(bfd[start:start + block], dtype=np.float64)
+        ybin = np.floor((Y - ymin) * scale)
+        # Points at ymax belong to the last bin
+        ybin[Y == ymax] = bins - 1
+        valid = (ybin >= 0) & (ybin < bins)
+        rows = np.broadcast_to(np.arange(len(Y))[:, None], Y.shape)
+        flat = rows[valid] * bins + ybin[valid].astype(np.int64)
+        H[start:start + len(Y)] = np.bincount(flat, minlength=len(Y) * bins).reshape(len(Y), bins)
+    return H
+
+def bfd_density_plot(bf_param, bf_range, bfd, ylim, bins=500, log=True,
+                     ylabel="x", title=None, suptitle=None, cmap='Blues'):
+    plt.figure()
+    if title:
+        plt.title(title)
+    if suptitle:
+        plt.suptitle(suptitle)
+
+    order = np.argsort(bf_range)
+    H = bfd_raster(bfd[order], ylim, bins)
+    norm = LogNorm(vmin=1) if log else None
+    # Empty pixels are left blank
+    H = np.ma.masked_equal(H, 0)
+    yedges = np.linspace(ylim[0], ylim[1], bins + 1)
+    plt.pcolormesh(sweep_edges(np.asarray(bf_range)[order]), yedges, H.T,
+                   norm=norm, cmap=cmap, rasterized=True)
+    plt.colorbar(label='points')
+    plt.ylim(ylim)
+    plt.xlabel(bf_param)
+    plt.ylabel(ylabel)
+
+def load_bfds(run, variables, spp, skip, processes=None):
+    """ Load the Poincare points of a 1D sweep into a (n_vars, n_sweep, n_points) array
+
+    n_points is the number of points of a table times the number of
+    repeats. Points missing from shorter tables are NaN.
+    """
+    n_vars = len(variables)
+    n_repeats = max(run.repeat_counts())
+
+    # Size the array for the longest table, rows are counted with the row
+    # index, which the loaders reuse
+    jobs = [(run.get_table_filename(i, j), spp, skip)
+            for i in range(run.run_count) for j in range(run.repeat_count(i))]
+    with multiprocessing.Pool(processes) as pool:
+        n_table = max(pool.map(count_bfd_points, jobs))
+    bfds = np.full((n_vars, run.run_count, n_repeats * n_table), np.nan, dtype=np.float32)
+
+    tables = run.iter_tables(variables, spp, skip, processes=processes,
+                             ordered=False, progress=True, loader=load_bfd_table)
+    for j, k, X in tables:
+        assert X is not None, "{}: No such file".format(run.get_table_filename(j, k))
+        bfds[:, j, k * n_table:k * n_table + len(X)] = X.T
+
+    return bfds
+
 def main(args):
-    basedir = os.path.dirname(args.filename)
-    info = load_run_info(args.filename)
-    run_info = info['run_info']
-    sweep_spec = info['sweep_spec']
+    run = RunInfo(args.filename, load=True)
+    sweep_spec = run['sweep_spec']
     assert len(sweep_spec) == 1, "Sweep must be 1D"
     sweep_spec = sweep_spec[0]
     sweep_param = sweep_spec[0][0]
     sweep_values = [sp[1] for sp in sweep_spec]
 
     print("#Parameter values: {}".format(len(sweep_values)))
-    print("#Runs per value: {}".format(len(run_info[0])))
+    print("#Runs per value: {}".format(run.repeat_count(0)))
     print("Bifurcation parameter: {}".format(sweep_param))
     print("Parameter range: {}..{} [{}]".format(
         np.min(sweep_values), np.max(sweep_values),
         sweep_values[1] - sweep_values[0]))
 
     # Learn available variables from first run
-    mx3_filename = os.path.join(basedir, run_info[0][0]['filename'])
-    tablefile = get_tablefile(mx3_filename)
-    headers, _ = parse_table_header(tablefile)
+    headers = run.get_header(0, 0)
     variables = match_vars(args.var, headers)
 
     print("Variables: {}".format(", ".join(variables)))
 
     n_vars = len(variables)
-    bfds = [[] for _ in range(n_vars)] # indexed by variable
-
-    for j, runs in enumerate(run_info):
-        for i in range(n_vars):
-            bfds[i].append([])
-        for run in runs:
-            print(".", end='', flush=True)
-            filename = os.path.join(basedir, run['filename'])
-            X = load_bfd(filename, variables, args.spp, args.skip)
-            for i in range(X.shape[1]):
-                bfds[i][-1].extend(X[:,i])
-
-    bfds = np.array(bfds)
-
-    print("")
+    bfds = load_bfds(run, variables, args.spp, args.skip, args.jobs)
+    print("Points per parameter value: {}".format(bfds.shape[2]))
 
     colors = cycle(plt.rcParams['axes.prop_cycle'].by_key()['color'])
 
     for i, bfd in enumerate(bfds):
-        bfd_plot(sweep_param, sweep_values, bfd,
-                ylabel=variables[i], title=variables[i], ylim=args.ylim,
-                color=next(colors))
+        if args.scatter:
+            bfd_plot(sweep_param, sweep_values, bfd,
+                    ylabel=variables[i], title=variables[i], ylim=args.ylim,
+                    color=next(colors))
+        else:
+            bfd_density_plot(sweep_param, sweep_values, bfd, args.ylim, args.bins,
+                    log=not args.linear, ylabel=variables[i], title=variables[i])
 
     if args.savefig:
         filename = args.savefig
@@ -128,8 +193,16 @@ if __name__ == '__main__':
             help='Samples per period')
     parser.add_argument('-k', '--skip', type=float, default=100,
             help='Periods to skip')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='Number of processes used to load tables (default: all cores)')
     parser.add_argument('--ylim', nargs=2, type=float, default=(-1, 1),
             metavar=('YMIN', 'YMAX'), help='set ylim (default: %(default)s)')
+    parser.add_argument('-b', '--bins', type=int, default=500,
+            help='Number of pixels along y (default: %(default)s)')
+    parser.add_argument('--linear', action='store_true',
+            help='Linear instead of logarithmic density colors')
+    parser.add_argument('--scatter', action='store_true',
+            help='Plot every point instead of the point density (slow for large sweeps)')
     parser.add_argument('-o', '--savefig',
             help='Save figure(s) to file')
 
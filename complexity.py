@@ -0,0 +1,154 @@
+"""
+Complexity estimators for sequences of digitized states
+
+States are given as keys (see statekeys and statestream), one per sample,
+and each distinct state is treated as one symbol.
+"""
+import numpy as np
+
+def as_symbols(keys):
+    """ Number the distinct keys 0..k-1, returns (symbols, k) """
+    keys = np.asarray(keys)
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64), 0
+    uniq, symbols = np.unique(keys, axis=0, return_inverse=True)
+    return symbols.ravel(), len(uniq)
+
+def rank_levels(s):
+    """ Ranks of the substrings of length 1, 2, 4, ... at each position of s,
+    by prefix doubling until all suffixes are told apart
+
+    Returns (levels, sa) where levels[t][i] is the rank of s[i:i + 2**t]
+    (substrings cut short by the end of s have ranks of their own) and sa
+    is the suffix array.
+    """
+    n = len(s)
+    dtype = np.int32 if n < 2**31 else np.int64
+    _, rank = np.unique(s, return_inverse=True)
+    rank = rank.ravel().astype(dtype)
+    levels = [rank]
+    k = 1
+    while n and rank.max() < n - 1:
+        # Sort by the ranks of the first k and the next k symbols
+        second = np.full(n, -1, dtype=dtype)
+        second[:n - k] = rank[k:]
+        sa = np.lexsort((second, rank))
+        r, r2 = rank[sa], second[sa]
+        new_group = np.ones(n, dtype=dtype)
+        new_group[1:] = (r[1:] != r[:-1]) | (r2[1:] != r2[:-1])
+        rank = np.empty(n, dtype=dtype)
+        rank[sa] = np.cumsum(new_group, dtype=dtype) - 1
+        levels.append(rank)
+        k *= 2
+    sa = np.empty(n, dtype=np.int64)
+    sa[rank] = np.arange(n)
+    return levels, sa
+
+def suffix_array(s):
+    """ Suffix array of a sequence of symbols, by prefix doubling """
+    return rank_levels(s)[1]
+
+def common_prefix(levels, i, j):
+    """ Longest common prefix of the suffixes at i and j (arrays), by binary
+    lifting over the rank levels of rank_levels
+    """
+    n = len(levels[0])
+    lcp = np.zeros(len(i), dtype=np.int64)
+    for t in reversed(range(len(levels))):
+        a, b = i + lcp, j + lcp
+        match = (a < n) & (b < n)
+        match[match] = levels[t][a[match]] == levels[t][b[match]]
+        lcp[match] += 2**t
+    return lcp
+
+def range_minima(a):
+    """ Sparse table, level t holds the minima of a[q:q + 2**t] """
+    table = [a]
+    w = 1
+    while 2 * w <= len(a):
+        prev = table[-1]
+        table.append(np.minimum(prev[:len(prev) - w], prev[w:]))
+        w *= 2
+    return table
+
+def nearest_smaller(a):
+    """ Indices of the nearest smaller element of a (distinct values) before
+    and after each position, -1 if there is none
+    """
+    n = len(a)
+    table = range_minima(a)
+    pos = np.arange(n)
+    before = pos.copy()
+    after = pos + 1
+    # Skip the run of larger elements next to each position, largest blocks first
+    for t in reversed(range(len(table))):
+        w = 2**t
+        ok = before >= w
+        ok[ok] = table[t][before[ok] - w] > a[ok]
+        before[ok] -= w
+        ok = after + w <= n
+        ok[ok] = table[t][after[ok]] > a[ok]
+        after[ok] += w
+    before -= 1
+    after[after >= n] = -1
+    return before, after
+
+def longest_previous_factor(s):
+    """ For each i, the length of the longest prefix of s[i:] that also starts
+    at some j < i
+
+    The best j is the nearest suffix before or after s[i:] in suffix array
+    order that starts before i (Crochemore and Ilie), found for all i at once
+    with numpy in O(n log n).
+    """
+    n = len(s)
+    levels, sa = rank_levels(s)
+    lpf = np.zeros(n, dtype=np.int64)
+    for neighbor in nearest_smaller(sa):
+        has = neighbor >= 0
+        i = sa[has]
+        lpf[i] = np.maximum(lpf[i], common_prefix(levels, i, sa[neighbor[has]]))
+    return lpf
+
+def lz76(keys):
+    """ Lempel-Ziv (1976) complexity, the number of phrases in the
+    Kaspar-Schuster parsing of the sequence
+
+    Each phrase extends the longest previous factor at its start by one
+    symbol, so only the phrase starts are visited in Python.
+    """
+    s, _ = as_symbols(keys)
+    n = len(s)
+    if n == 0:
+        return 0
+    lpf = longest_previous_factor(s).tolist()
+    c = 0
+    i = 0
+    while i < n:
+        c += 1
+        i += lpf[i] + 1
+    return c
+
+def lz76_normalized(keys):
+    """ LZ76 complexity normalized by n / log_k(n), about 1 for random sequences """
+    s, k = as_symbols(keys)
+    n = len(s)
+    if n < 2:
+        return 0.0
+    return lz76(keys) * np.log(n) / np.log(max(k, 2)) / n
+
+def block_entropy(keys, block=1):
+    """ Shannon entropy (bits) of the blocks of block consecutive states """
+    s, _ = as_symbols(keys)
+    if len(s) < block or block < 1:
+        return 0.0
+    blocks = np.lib.stride_tricks.sliding_window_view(s, block)
+    _, counts = np.unique(blocks, axis=0, return_counts=True)
+    p = counts / counts.sum()
+    return float(-np.sum(p * np.log2(p)))
+
+def entropy_rate(keys, block=1):
+    """ Block entropy estimate of the entropy rate, H(block) - H(block - 1) """
+    if block <= 1:
+        return block_entropy(keys, block)
+    return block_entropy(keys, block) - block_entropy(keys, block - 1)
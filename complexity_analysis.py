@@ -10,7 +10,11 @@ from collections import defaultdict
 import pickle
 import signal
 import pdb
-from mx3util import load_table
+import multiprocessing
+from mx3util import iter_table_chunks
+from statestream import load_state_stream
+from statekeys import packed_keys
+from complexity import lz76, block_entropy
 
 def handle_pdb(sig, frame):
     pdb.Pdb().set_trace(frame)    
@@ -18,8 +22,6 @@ def handle_pdb(sig, frame):
 def install_pdb(sig = signal.SIGINT):
     signal.signal(sig, handle_pdb)
 
-install_pdb()
-
 columns = [
     'm.region1x',
     'm.region2x',
@@ -50,38 +52,139 @@ def parse_path(path):
 def digitize(data):
     return np.where(data > 0, 1, 0).astype('uint8')
 
+compressors = {
+    'bz2': bz2.BZ2Compressor,
+    'zlib': zlib.compressobj,
+}
+
+def compressed_size(filename, columns, compression):
+    """ Size of the digitized table, compressed chunk by chunk
+
+    Returns (size, shape of the digitized data).
+    """
+    compressor = compressors[compression]()
+    size = 0
+    n_rows = 0
+    n_cols = 0
+    for data in iter_table_chunks(filename, columns):
+        ddata = digitize(data)
+        size += len(compressor.compress(ddata.tobytes()))
+        n_rows += ddata.shape[0]
+        n_cols = ddata.shape[1]
+    size += len(compressor.flush())
+    return size, (n_rows, n_cols)
+
+def packed_complexity(filename, columns, compression, step=1, skip=0, block=4):
+    """ Complexity of the bit-packed state stream of a table
+
+    Returns (complexity, shape of the digitized data). The compressors see
+    the packed bytes, lz76 and entropy (block entropy in bits) the states.
+    """
+    packed, n_bits = load_state_stream(filename, columns, step, skip)
+    shape = (len(packed), n_bits)
+
+    if compression == 'lz76':
+        return lz76(packed_keys(packed)), shape
+    if compression == 'entropy':
+        return block_entropy(packed_keys(packed), block), shape
+
+    compressor = compressors[compression]()
+    size = len(compressor.compress(packed.tobytes())) + len(compressor.flush())
+    return size, shape
+
+def get_complexity_cache(filename):
+    return filename + '.complexity'
+
+def cached_result(filename, key, fn, *args):
+    """ fn(*args), cached next to the table under key """
+    cachefile = get_complexity_cache(filename)
+    st = os.stat(filename)
+    source = (st.st_size, st.st_mtime_ns)
+
+    cache = {}
+    if os.path.exists(cachefile):
+        try:
+            cache = pickle.load(open(cachefile, 'rb'))
+        except (EOFError, pickle.UnpicklingError):
+            pass
+        if cache.get('source') != source:
+            cache = {}
+
+    if key in cache:
+        return cache[key]
+
+    result = fn(*args)
+
+    cache['source'] = source
+    cache[key] = result
+    tmp = '{}.{}.tmp'.format(cachefile, os.getpid())
+    try:
+        pickle.dump(cache, open(tmp, 'wb'))
+        os.replace(tmp, cachefile)
+    except OSError:
+        # Read only sweep, results are still valid
+        pass
+
+    return result
+
+def table_complexity(filename, compression='bz2', cache=True, packed=False, step=1, skip=0, block=4):
+    """ Complexity of a table as reported by this script, returns (complexity, shape) """
+    if packed or compression not in compressors:
+        fn = packed_complexity
+        args = (filename, columns, compression, step, skip, block)
+        key = (tuple(columns), compression, 'packed', step, skip, block)
+    else:
+        fn = compressed_size
+        args = (filename, columns, compression)
+        key = (tuple(columns), compression)
+
+    if cache:
+        return cached_result(filename, key, fn, *args)
+    return fn(*args)
+
+def analyze_dir(job):
+    """ Worker: returns (complexity, shape, error) for one out directory """
+    dir, compression, cache, packed, step, skip, block = job
+    filename = os.path.join(dir, 'table.txt')
+
+    try:
+        oc, shape = table_complexity(filename, compression, cache, packed, step, skip, block)
+    except ValueError as e:
+        return None, None, e
+    return oc, shape, None
+
+def init_worker():
+    # Only the main process drops into pdb on SIGINT
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
 def main(args):
     dir_info = list(map(parse_path, args.dirs))
 
     complexity = defaultdict(list)
 
-    compress = bz2.compress
-    if args.compression == 'zlib':
-        compress = zlib.compress
-
     dirs_skipped = []
 
-    for dir, info in zip(args.dirs, dir_info):
+    jobs = [(dir, args.compression, not args.no_cache, args.packed, args.spp, args.skip, args.block)
+            for dir in args.dirs]
+    pool = multiprocessing.Pool(args.jobs, init_worker)
+    results = pool.imap(analyze_dir, jobs)
+
+    for dir, info, (oc, shape, error) in zip(args.dirs, dir_info, results):
         key = info[1]
         filename = os.path.join(dir, 'table.txt')
         print("Loading {}...".format(filename))
-        try:
-            data = load_table(filename, columns)
-        except ValueError as e:
-            print("  ERROR: ", e, ", skipping!", sep='')
+        if error is not None:
+            print("  ERROR: ", error, ", skipping!", sep='')
             dirs_skipped.append(dir)
             continue
 
-        # debug
-        # data = data[:100]
-
-        print("  data:", data.shape, data.dtype)
-        ddata = digitize(data)
-        print("  ddata:", ddata.shape, ddata.dtype)
-        oc = len(compress(ddata.tostring()))
+        print("  ddata:", shape)
         print("  complexity:", oc)
         complexity[key].append(oc)
 
+    pool.close()
+    pool.join()
+
     print("complexity=", complexity)
 
     for key in sorted(complexity.keys()):
@@ -96,6 +199,7 @@ def main(args):
             'dir_info': dir_info,
             'dirs_skipped': dirs_skipped,
             'compression': args.compression,
+            'packed': args.packed or args.compression not in compressors,
             'complexity': complexity
         }
         pickle.dump(d, open(args.output, 'wb'))
@@ -103,11 +207,25 @@ def main(args):
 if __name__ == '__main__':
     import argparse
 
+    install_pdb()
+
     parser = argparse.ArgumentParser(description='Complexity analysis')
     parser.add_argument('-o', '--output', metavar='FILE',
             help='save result to file')
-    parser.add_argument('-c', '--compression', choices=('zlib', 'bz2'), default='bz2',
-            help='compression algorithm (default: %(default)s)')
+    parser.add_argument('-c', '--compression', choices=('zlib', 'bz2', 'lz76', 'entropy'), default='bz2',
+            help='compression algorithm, or LZ76 / block entropy of the states (default: %(default)s)')
+    parser.add_argument('-p', '--packed', action='store_true',
+            help='compress the bit-packed state stream (implied by lz76 and entropy)')
+    parser.add_argument('-s', '--spp', type=int, default=1,
+            help='samples per period of the state stream (default: every row)')
+    parser.add_argument('-k', '--skip', type=float, default=0,
+            help='periods to skip in the state stream')
+    parser.add_argument('-L', '--block', type=int, default=4,
+            help='block length for entropy (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='number of parallel processes (default: number of CPUs)')
+    parser.add_argument('--no-cache', action='store_true',
+            help='do not use or update cached results')
     parser.add_argument('dirs', nargs='+', metavar='DIR',
             help='out directories to analyse')
 
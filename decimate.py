@@ -0,0 +1,65 @@
+"""
+Decimation of long traces for plotting
+
+Both methods return the indices of the points to keep, in order, so that
+they apply to x and y alike. A trace is reduced to about n_out points,
+which should be about twice the width of the plot in pixels.
+"""
+import numpy as np
+
+def minmax(x, y, n_out):
+    """ Min/max envelope, the lowest and highest point of each of n_out / 2 buckets """
+    n = len(y)
+    n_buckets = max(n_out // 2, 1)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+
+    # Equal buckets, and the remaining (fewer than bucket) points as a last bucket
+    bucket = -(-n // n_buckets)
+    n_full = n // bucket
+    Y = y[:n_full * bucket].reshape(n_full, bucket)
+    starts = np.arange(n_full) * bucket
+    lo = [starts + Y.argmin(axis=1)]
+    hi = [starts + Y.argmax(axis=1)]
+    if n_full * bucket < n:
+        rest = y[n_full * bucket:]
+        lo.append([n_full * bucket + rest.argmin()])
+        hi.append([n_full * bucket + rest.argmax()])
+
+    return np.unique(np.concatenate(lo + hi + [[0, n - 1]]))
+
+def lttb(x, y, n_out):
+    """ Largest-Triangle-Three-Buckets (Steinarsson 2013) downsampling to n_out points """
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    # First and last points are kept, the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+
+    a = 0
+    for k in range(n_out - 2):
+        lo, hi = edges[k], edges[k + 1]
+        # Third vertex at the average of the next bucket
+        next_hi = edges[k + 2] if k + 2 < len(edges) else n
+        cx = x[hi:next_hi].mean()
+        cy = y[hi:next_hi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + area.argmax()
+        keep[k + 1] = a
+
+    return keep
+
+methods = {
+    'minmax': minmax,
+    'lttb': lttb,
+}
+
+def decimate(x, y, n_out, method='minmax'):
+    """ Indices of about n_out points of (x, y) with the given method, or all points if None """
+    if method is None:
+        return np.arange(len(y))
+    return methods[method](x, y, n_out)
@@ -1,9 +1,27 @@
 #!/usr/bin/env python3
+"""
+Tile images of several runs into one image per frame, optionally as a video.
+
+Frames are composited in NumPy by a process pool and can be piped straight
+into ffmpeg. The ImageMagick montage engine is kept as a fallback.
+"""
 import os
+import sys
 import subprocess
+import tempfile
 import glob
+import itertools
+import collections
+import multiprocessing
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
 from jinja2 import Template
 
+# Spacing around each tile, like the montage default geometry (+4+3)
+TILE_SPACING = (3, 4)
+LABEL_HEIGHT = 14
+VIDEO_FRAMERATE = 24
+
 def montage(output_file, input_files, labels=None):
     cmd = ['montage', '-background', 'black', '-fill', 'white']
     if labels:
@@ -53,10 +71,198 @@ def make_video(output_file, input_dir, img_pattern='m%06d.png'):
 
     return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
+def load_image(filename):
+    """ Decode image as (height, width, 3) uint8 array, or None if it is missing """
+    try:
+        with Image.open(filename) as img:
+            return np.asarray(img.convert('RGB'))
+    except FileNotFoundError:
+        return None
+
+labels_cache = {}
+
+def render_label(label, width):
+    """ White label on black as (LABEL_HEIGHT, width, 3) array, rendered once per worker """
+    key = (label, width)
+    if key not in labels_cache:
+        img = Image.new('RGB', (width, LABEL_HEIGHT))
+        draw = ImageDraw.Draw(img)
+        font = ImageFont.load_default()
+        left, top, right, bottom = draw.textbbox((0, 0), label, font=font)
+        draw.text(((width - right + left) // 2, (LABEL_HEIGHT - bottom + top) // 2 - top),
+                  label, fill='white', font=font)
+        labels_cache[key] = np.asarray(img)
+    return labels_cache[key]
+
+def tile_frame(images, labels=None, columns=None, size=None):
+    """ Tile images (arrays, None for blank) on a black canvas, centered in equal cells
+
+    The canvas is padded to size (height, width) if given, and always has
+    even dimensions, as required by most video codecs.
+    """
+    n = len(images)
+    if columns is None:
+        columns = int(np.ceil(np.sqrt(n)))
+    rows = -(-n // columns)
+
+    shapes = [img.shape for img in images if img is not None]
+    tile_h = max([s[0] for s in shapes] or [1])
+    tile_w = max([s[1] for s in shapes] or [1])
+    pad_y, pad_x = TILE_SPACING
+    label_h = LABEL_HEIGHT if labels else 0
+    cell_h = tile_h + label_h + 2 * pad_y
+    cell_w = tile_w + 2 * pad_x
+
+    height, width = rows * cell_h, columns * cell_w
+    if size is not None:
+        height, width = size
+    canvas = np.zeros((height + height % 2, width + width % 2, 3), dtype=np.uint8)
+
+    for k, img in enumerate(images):
+        y0 = (k // columns) * cell_h + pad_y
+        x0 = (k % columns) * cell_w + pad_x
+        if img is not None:
+            h, w = img.shape[:2]
+            y = y0 + (tile_h - h) // 2
+            x = x0 + (tile_w - w) // 2
+            # Cropped if the canvas has a fixed, smaller size
+            h = max(min(h, canvas.shape[0] - y), 0)
+            w = max(min(w, canvas.shape[1] - x), 0)
+            canvas[y:y+h, x:x+w] = img[:h, :w]
+        if labels:
+            strip = render_label(labels[k], cell_w - 2 * pad_x)
+            y = y0 + tile_h
+            h = max(min(label_h, canvas.shape[0] - y), 0)
+            w = max(min(strip.shape[1], canvas.shape[1] - x0), 0)
+            canvas[y:y+h, x0:x0+w] = strip[:h, :w]
+
+    return canvas
+
+def composite_frame(job):
+    """ Worker: tile one frame, save it if output_file is given, return it if wanted """
+    input_files, labels, output_file, size, keep = job
+    frame = tile_frame([load_image(f) for f in input_files], labels, size=size)
+    if output_file:
+        Image.fromarray(frame).save(output_file)
+    return frame if keep else None
+
+def iter_composited(jobs, processes=None):
+    """ Composite frames in a process pool, yielding them in order
+
+    At most a few frames per process are in flight, so that memory use
+    stays bounded when frames are consumed slower than they are made.
+    """
+    with multiprocessing.Pool(processes) as pool:
+        max_pending = 2 * (processes or os.cpu_count())
+        pending = collections.deque()
+        for job in jobs:
+            pending.append(pool.apply_async(composite_frame, (job,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def open_video(output_file, size, framerate=VIDEO_FRAMERATE):
+    """ Start ffmpeg encoding raw RGB frames of size (height, width) from its stdin
+
+    Returns the process and the temporary file collecting its stderr, which
+    is a file rather than a pipe so that a chatty ffmpeg cannot block.
+    """
+    height, width = size
+    cmd = ['ffmpeg',
+           '-y',
+           '-f', 'rawvideo',
+           '-pix_fmt', 'rgb24',
+           '-s', '{}x{}'.format(width, height),
+           '-framerate', str(framerate),
+           '-i', '-',
+           '-pix_fmt', 'yuv420p',
+           output_file]
+
+    print("video {}".format(output_file))
+
+    log = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                            stdout=subprocess.DEVNULL, stderr=log)
+    return proc, log
+
+def close_video(proc, log, broken=False):
+    """ Finish the ffmpeg input and raise with its stderr if it failed """
+    try:
+        proc.stdin.close()
+    except BrokenPipeError:
+        broken = True
+    proc.wait()
+    log.seek(0)
+    stderr = log.read()
+    log.close()
+    if broken or proc.returncode != 0:
+        print(stderr.decode(errors='replace'), file=sys.stderr)
+        raise subprocess.CalledProcessError(proc.returncode, proc.args, stderr=stderr)
+
+def composite_dirs(output_dir, input_dirs, labels=True, label_template="{{i}}",
+                   glob_pattern='*.png', video=None, processes=None):
+    """ Tile the images of input_dirs frame by frame in NumPy
+
+    Frames are saved to output_dir if given and/or piped into ffmpeg to
+    make video, without intermediate files.
+    """
+    if output_dir:
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        assert os.path.isdir(output_dir)
+
+    if labels:
+        labels = list(gen_labels(input_dirs, label_template))
+
+    first_dir = input_dirs[0]
+    imgs = [os.path.basename(img) for img in sorted(glob.glob(os.path.join(first_dir, glob_pattern)))]
+    if not imgs:
+        return
+
+    def input_files(img):
+        return [os.path.join(d, img) for d in input_dirs]
+
+    def output_file(img):
+        return os.path.join(output_dir, img) if output_dir else None
+
+    # Video frames must all have the size of the first one, which is
+    # composited here and the rest in the pool
+    first = composite_frame((input_files(imgs[0]), labels, output_file(imgs[0]), None, True))
+    size = first.shape[:2]
+
+    jobs = ((input_files(img), labels, output_file(img), size, video is not None) for img in imgs[1:])
+    frames = itertools.chain([first], iter_composited(jobs, processes))
+    proc, log = open_video(video, size) if video else (None, None)
+    broken = False
+    try:
+        for n, frame in enumerate(frames, start=1):
+            if proc:
+                try:
+                    proc.stdin.write(frame.tobytes())
+                except BrokenPipeError:
+                    # ffmpeg exited early, its stderr tells why
+                    broken = True
+                    print("")
+                    break
+            print("\rmontage {}/{}".format(n, len(imgs)), end='', flush=True)
+        else:
+            print("")
+    finally:
+        if proc:
+            close_video(proc, log, broken)
+
 def main(args):
     input_dirs = list(map(os.path.isdir, args.files))
     if all(input_dirs):
         # Multiple output images
+        if args.engine == 'numpy':
+            assert args.output or args.video, "Output directory (-o) or video (-m) required"
+            composite_dirs(args.output, args.files, args.labels, args.label_template,
+                           video=args.video, processes=args.jobs)
+            return
+
+        assert args.output, "Output directory (-o) required"
         montage_dirs(args.output, args.files, args.labels, args.label_template)
 
         if args.video:
@@ -64,7 +270,13 @@ def main(args):
 
     elif not any(input_dirs):
         # Single output image
-        montage_single(args.output, args.files, args.labels, args.label_template)
+        assert args.output, "Output file (-o) required"
+        if args.engine == 'numpy':
+            labels = list(gen_labels(args.files, args.label_template)) if args.labels else None
+            print("montage {}".format(args.output))
+            composite_frame((args.files, labels, args.output, None, False))
+        else:
+            montage_single(args.output, args.files, args.labels, args.label_template)
     else:
         print("ERROR: Can't mix directories and files as input")
 
@@ -72,16 +284,21 @@ def main(args):
 if __name__ == '__main__':
     import argparse
 
-    parser = argparse.ArgumentParser(description=__doc__)
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('files', nargs='+',
                         help='list of input files or directories')
-    parser.add_argument('-o', '--output', required=True,
-            help='output file or directory')
+    parser.add_argument('-o', '--output',
+            help='output file or directory (optional for directories with --video)')
     parser.add_argument('-m', '--video', help='make video')
     parser.add_argument('-l', '--labels', action='store_true', default=False,
             help='enable labels')
     parser.add_argument('-f', '--label-template', default='{{i}}',
             help='label template string')
+    parser.add_argument('-e', '--engine', choices=['numpy', 'imagemagick'], default='numpy',
+            help='compositing engine (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='number of parallel processes (default: number of CPUs)')
 
     args = parser.parse_args()
 
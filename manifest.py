@@ -0,0 +1,205 @@
+import time
+import pickle
+import sqlite3
+import numpy as np
+
+MANIFEST_FILENAME = 'run_info.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value BLOB
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    run_index INTEGER NOT NULL,
+    repeat_index INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    params BLOB,
+    status TEXT NOT NULL DEFAULT 'queued',
+    start_time REAL,
+    end_time REAL,
+    exit_code INTEGER,
+    hash TEXT,
+    UNIQUE (run_index, repeat_index)
+);
+CREATE TABLE IF NOT EXISTS params (
+    job_id INTEGER NOT NULL REFERENCES jobs(id),
+    key TEXT NOT NULL,
+    value,
+    PRIMARY KEY (job_id, key)
+);
+CREATE INDEX IF NOT EXISTS params_key_value ON params (key, value);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+'''
+
+def sql_value(v):
+    """ Convert parameter value to a type SQLite can compare
+
+    Numbers given as strings (-p parameters) are stored as numbers, so that
+    they compare numerically like sweep parameters.
+    """
+    if isinstance(v, np.generic):
+        v = v.item()
+    if isinstance(v, str):
+        for number in (int, float):
+            try:
+                return number(v)
+            except ValueError:
+                pass
+        return v
+    if isinstance(v, (int, float)):
+        return v
+    return str(v)
+
+class Manifest(object):
+    """ SQLite run manifest with one row per job
+
+    Sweep metadata (sweep_spec, repeat, args, ...) is kept in the info
+    table, job parameters are kept both as a pickle and as indexed
+    key/value rows so that sweeps can be queried without loading them.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+        self.upgrade()
+        self._run_info = None
+
+    def upgrade(self):
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(jobs)')]
+        if 'hash' not in columns:
+            with self.db:
+                self.db.execute('ALTER TABLE jobs ADD COLUMN hash TEXT')
+
+    def close(self):
+        self.db.close()
+
+    def get_info(self):
+        rows = self.db.execute('SELECT key, value FROM info')
+        return {k: pickle.loads(v) for k, v in rows}
+
+    def set_info(self, info):
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO info VALUES (?, ?)',
+                    [(k, pickle.dumps(v)) for k, v in info.items() if k != 'run_info'])
+
+    def clear_jobs(self):
+        with self.db:
+            self.db.execute('DELETE FROM params')
+            self.db.execute('DELETE FROM jobs')
+        self._run_info = None
+
+    def add_jobs(self, jobs, index_keys=None):
+        """ Add jobs given as (run_index, repeat_index, filename, params, hash)
+
+        Existing jobs are updated but keep their status. Only the
+        parameters in index_keys (default: all) can be queried.
+        """
+        with self.db:
+            for run_index, repeat_index, filename, params, h in jobs:
+                row = self.db.execute('SELECT id FROM jobs WHERE run_index = ? AND repeat_index = ?',
+                        (run_index, repeat_index)).fetchone()
+                if row:
+                    job_id, = row
+                    self.db.execute('UPDATE jobs SET filename = ?, params = ?, hash = ? WHERE id = ?',
+                            (filename, pickle.dumps(params), h, job_id))
+                    self.db.execute('DELETE FROM params WHERE job_id = ?', (job_id,))
+                else:
+                    cur = self.db.execute('INSERT INTO jobs '
+                            '(run_index, repeat_index, filename, params, hash) VALUES (?, ?, ?, ?, ?)',
+                            (run_index, repeat_index, filename, pickle.dumps(params), h))
+                    job_id = cur.lastrowid
+                keys = params.keys() if index_keys is None else index_keys
+                self.db.executemany('INSERT INTO params VALUES (?, ?, ?)',
+                        [(job_id, k, sql_value(params[k])) for k in keys if k in params])
+        self._run_info = None
+
+    def set_status(self, jobs, status, exit_code=None, start_time=None, end_time=None):
+        """ Update status of jobs given as (run_index, repeat_index) """
+        if status == 'running' and start_time is None:
+            start_time = time.time()
+        if status in ('finished', 'failed') and end_time is None:
+            end_time = time.time()
+
+        with self.db:
+            self.db.executemany('UPDATE jobs SET status = ?, '
+                    'exit_code = COALESCE(?, exit_code), '
+                    'start_time = COALESCE(?, start_time), '
+                    'end_time = COALESCE(?, end_time) '
+                    'WHERE run_index = ? AND repeat_index = ?',
+                    [(status, exit_code, start_time, end_time, i, j) for i, j in jobs])
+
+    def query(self, status=None, **params):
+        """ Find jobs matching status and parameter values or (min, max) ranges
+
+        For example query('finished', B=(0.07, 0.08)) returns all finished
+        runs with B between 0.07 and 0.08, as (run_index, repeat_index).
+        """
+        sql = 'SELECT run_index, repeat_index FROM jobs'
+        where = []
+        args = []
+        if status:
+            where.append('status = ?')
+            args.append(status)
+        for k, v in params.items():
+            if isinstance(v, tuple):
+                where.append('id IN (SELECT job_id FROM params WHERE key = ? AND value BETWEEN ? AND ?)')
+                args.extend([k, sql_value(v[0]), sql_value(v[1])])
+            else:
+                where.append('id IN (SELECT job_id FROM params WHERE key = ? AND value = ?)')
+                args.extend([k, sql_value(v)])
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY run_index, repeat_index'
+        return self.db.execute(sql, args).fetchall()
+
+    def get_states(self):
+        """ Status and content hash of all jobs, keyed by (run_index, repeat_index) """
+        rows = self.db.execute('SELECT run_index, repeat_index, status, hash FROM jobs')
+        return {(i, j): (status, h) for i, j, status, h in rows}
+
+    def get_job(self, run_index, repeat_index):
+        row = self.db.execute('SELECT filename, params, status, start_time, end_time, exit_code, hash '
+                'FROM jobs WHERE run_index = ? AND repeat_index = ?',
+                (run_index, repeat_index)).fetchone()
+        if row is None:
+            raise IndexError((run_index, repeat_index))
+        keys = ('filename', 'params', 'status', 'start_time', 'end_time', 'exit_code', 'hash')
+        job = dict(zip(keys, row))
+        job['params'] = pickle.loads(job['params'])
+        return job
+
+    def get_filename(self, run_index, repeat_index):
+        row = self.db.execute('SELECT filename FROM jobs WHERE run_index = ? AND repeat_index = ?',
+                (run_index, repeat_index)).fetchone()
+        if row is None:
+            raise IndexError((run_index, repeat_index))
+        return row[0]
+
+    @property
+    def run_count(self):
+        n, = self.db.execute('SELECT COALESCE(MAX(run_index) + 1, 0) FROM jobs').fetchone()
+        return n
+
+    def repeat_count(self, run_index):
+        n, = self.db.execute('SELECT COUNT(*) FROM jobs WHERE run_index = ?', (run_index,)).fetchone()
+        return n
+
+    def repeat_counts(self):
+        counts = [0] * self.run_count
+        for i, n in self.db.execute('SELECT run_index, COUNT(*) FROM jobs GROUP BY run_index'):
+            counts[i] = n
+        return counts
+
+    @property
+    def run_info(self):
+        """ Jobs as nested list of dicts, indexed by run and repeat like run_info.pickle """
+        if self._run_info is None:
+            run_info = [[] for _ in range(self.run_count)]
+            rows = self.db.execute('SELECT run_index, filename, params FROM jobs '
+                    'ORDER BY run_index, repeat_index')
+            for i, filename, params in rows:
+                run_info[i].append({'params': pickle.loads(params), 'filename': filename})
+            self._run_info = run_info
+        return self._run_info
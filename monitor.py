@@ -0,0 +1,183 @@
+import os
+import struct
+import asyncio
+import ctypes
+import ctypes.util
+
+# inotify event masks, see inotify(7)
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_NONBLOCK = os.O_NONBLOCK
+
+# Fallback interval for file systems that do not deliver inotify events,
+# such as network file systems written to by other nodes
+POLL_INTERVAL = 1
+
+libc = None
+
+def get_libc():
+    global libc
+    if libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return libc
+
+class Inotify(object):
+    """ Minimal inotify wrapper, raises OSError where inotify is unavailable """
+    def __init__(self):
+        try:
+            self.libc = get_libc()
+            self.fd = self.libc.inotify_init1(IN_NONBLOCK)
+        except (OSError, AttributeError):
+            raise OSError("inotify not available")
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed", path)
+        return wd
+
+    def read(self):
+        """ Read pending events as (wd, mask, name) """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        i = 0
+        while i < len(data):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, i)
+            i += 16
+            name = data[i:i+length].rstrip(b'\0')
+            i += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+async def wait_readable(fd, timeout):
+    loop = asyncio.get_event_loop()
+    ready = loop.create_future()
+    loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+    try:
+        await asyncio.wait_for(ready, timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        loop.remove_reader(fd)
+
+async def wait_for_change(path, timeout=POLL_INTERVAL):
+    """ Wait until something is created in directory path, or timeout """
+    try:
+        inotify = Inotify()
+    except OSError:
+        await asyncio.sleep(timeout)
+        return
+
+    try:
+        inotify.add_watch(path, IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE | IN_MODIFY)
+        await wait_readable(inotify.fd, timeout)
+    except OSError:
+        await asyncio.sleep(timeout)
+    finally:
+        inotify.close()
+
+async def wait_for_file(path, timeout=POLL_INTERVAL):
+    """ Wait until path exists, using inotify where available """
+    while not os.path.exists(path):
+        # Watch the nearest existing parent, it may be created in steps
+        parent = os.path.dirname(os.path.abspath(path))
+        while not os.path.isdir(parent):
+            parent = os.path.dirname(parent)
+        await wait_for_change(parent, timeout)
+    return path
+
+async def wait_process(p, timeout=POLL_INTERVAL):
+    """ Wait for subprocess.Popen p to exit, returning its exit code
+
+    Uses a pidfd where available so that no thread or polling is needed.
+    """
+    try:
+        pidfd = os.pidfd_open(p.pid)
+    except (AttributeError, OSError):
+        pidfd = None
+
+    if pidfd is None:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, p.wait)
+
+    try:
+        while p.poll() is None:
+            await wait_readable(pidfd, timeout)
+    finally:
+        os.close(pidfd)
+    return p.returncode
+
+async def wait_until(predicate, interval=POLL_INTERVAL):
+    """ Call predicate every interval seconds until it returns True
+
+    For things that cannot be waited on directly, such as jobs submitted by
+    another process. The predicate runs in an executor as it may block.
+    """
+    loop = asyncio.get_event_loop()
+    while not await loop.run_in_executor(None, predicate):
+        await asyncio.sleep(interval)
+
+class CompletionMonitor(object):
+    """ Dispatch follow-up work as soon as jobs complete
+
+    Callbacks are called from the event loop in the calling thread, and
+    may add further watches. run() returns when nothing is left to watch.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.tasks = set()
+
+    def watch(self, coro, callback):
+        async def wrapper():
+            result = await coro
+            callback(result)
+        task = self.loop.create_task(wrapper())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def watch_process(self, p, callback):
+        """ Call callback(exit code) when subprocess.Popen p exits """
+        return self.watch(wait_process(p), callback)
+
+    def watch_file(self, path, callback):
+        """ Call callback(path) when path exists """
+        return self.watch(wait_for_file(path), callback)
+
+    def watch_until(self, predicate, callback, interval=POLL_INTERVAL):
+        """ Call callback(None) once predicate() returns True """
+        return self.watch(wait_until(predicate, interval), callback)
+
+    def watch_scheduler(self, scheduler, callback):
+        """ Call callback(job, exit code) for each job a LocalScheduler completes """
+        async def drain():
+            while scheduler.pending:
+                done = await self.loop.run_in_executor(None, scheduler.poll, POLL_INTERVAL)
+                for job, exit_code in done:
+                    callback(job, exit_code)
+        task = self.loop.create_task(drain())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def run(self):
+        async def drain():
+            while self.tasks:
+                done, _ = await asyncio.wait(list(self.tasks))
+                # Raise exceptions from callbacks
+                for task in done:
+                    task.result()
+        self.loop.run_until_complete(drain())
+
+    def close(self):
+        self.loop.close()
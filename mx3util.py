@@ -1,13 +1,20 @@
 import copy
 import subprocess
 import os
+import time
 import argparse
 import re
 import fnmatch
 import pickle
+import hashlib
+import zipfile
+import multiprocessing
 import numpy as np
+from itertools import islice
 from collections import OrderedDict
 from jinja2 import Environment, FileSystemLoader, StrictUndefined
+from manifest import Manifest, MANIFEST_FILENAME
+import statekeys
 try:
     from subprocess import DEVNULL
 except ImportError:
@@ -16,17 +23,88 @@ except ImportError:
 TEMPLATES_PATH = ['templates', '.']
 DEFAULT_JOB_SCRIPT_TEMPLATE = 'mumax3.slurm.sh'
 
+# Cache parsed tables in binary sidecar files (table.txt.npy)
+TABLE_CACHE = os.environ.get('MX3_TABLE_CACHE', '1') != '0'
+
+# Consolidated sweep written by pack_sweep.py
+PACK_FILENAME = 'sweep.npz'
+
+# Rows per chunk for iter_table_chunks
+CHUNK_ROWS = 1 << 16
+
+# Index byte offsets of table rows in sidecar files (table.txt.rowidx)
+ROW_INDEX = os.environ.get('MX3_ROW_INDEX', '1') != '0'
+
+# Rows between indexed offsets
+ROW_INDEX_EVERY = 1024
+
+# Bytes before the end of the indexed part of a table that must be unchanged
+# for the row index to be extended rather than rebuilt
+ROW_INDEX_TAIL = 4096
+
+
+environments = {}
+
+def get_environment():
+    """ Jinja environment for TEMPLATES_PATH, kept so compiled templates are reused """
+    key = tuple(TEMPLATES_PATH)
+    if key not in environments:
+        loader = FileSystemLoader(TEMPLATES_PATH)
+        environments[key] = Environment(loader=loader, trim_blocks=True,
+                                        undefined=StrictUndefined, auto_reload=False)
+    return environments[key]
 
 def get_template(template):
-    loader = FileSystemLoader(TEMPLATES_PATH)
-    env = Environment(loader=loader, trim_blocks=True, undefined=StrictUndefined)
-    return env.get_template(template)
+    return get_environment().get_template(template)
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+def file_hash(filename):
+    with open(filename, 'rb') as f:
+        return content_hash(f.read())
+
+def gen_job(template, outfile, keep_unchanged=False, **params):
+    """ Render template to outfile, returning (content hash, written)
 
-def gen_job(template, outfile, **params):
+    With keep_unchanged, an existing outfile with identical content is
+    left untouched.
+    """
     tpl = get_template(template)
     mx3 = tpl.render(**params)
+    h = content_hash(mx3)
+    if keep_unchanged and os.path.exists(outfile) and file_hash(outfile) == h:
+        return h, False
     with open(outfile, 'w') as f:
         f.write(mx3)
+    return h, True
+
+def gen_job_args(job):
+    template, outfile, keep_unchanged, params = job
+    return gen_job(template, outfile, keep_unchanged, **params)
+
+def gen_jobs(template, jobs, processes=None, quiet=False, keep_unchanged=False):
+    """ Render jobs given as (outfile, params) using a process pool
+
+    Returns (content hash, written) for each job, see gen_job.
+    """
+    t0 = time.time()
+    args = [(template, outfile, keep_unchanged, params) for outfile, params in jobs]
+
+    if processes == 1 or len(args) < 2:
+        results = list(map(gen_job_args, args))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = list(pool.imap(gen_job_args, args, chunksize=64))
+
+    dt = time.time() - t0
+    if not quiet:
+        print("Rendered {} jobs in {:.1f}s ({:.0f} jobs/s)".format(
+            len(args), dt, len(args) / dt if dt > 0 else 0))
+
+    return results
 
 def run_local(jobs, wait=True, quiet=False, interactive=False):
     cmd = ['mumax3']
@@ -44,7 +122,7 @@ def run_local(jobs, wait=True, quiet=False, interactive=False):
 
     return p
 
-def run_dist(jobs, wait=True, job_script_template=DEFAULT_JOB_SCRIPT_TEMPLATE):
+def run_dist(jobs, wait=True, job_script_template=DEFAULT_JOB_SCRIPT_TEMPLATE, parsable=False):
     #
     # Generate job script
     #
@@ -64,8 +142,13 @@ def run_dist(jobs, wait=True, job_script_template=DEFAULT_JOB_SCRIPT_TEMPLATE):
     #
     # Submit job
     #
-    cmd = ['sbatch', '--wait', job_script]
-    p = subprocess.Popen(cmd)
+    # With parsable, the Slurm job ID is the first line of p.stdout
+    if parsable:
+        cmd = ['sbatch', '--wait', '--parsable', job_script]
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+    else:
+        cmd = ['sbatch', '--wait', job_script]
+        p = subprocess.Popen(cmd)
 
     if wait:
         p.wait()
@@ -81,6 +164,12 @@ class StoreKeyValue(argparse.Action):
         d[k] = v
 
 def parse_table_header(filename):
+    packed = find_pack(filename)
+    if packed is not None:
+        pack, name = packed
+        meta = pack.get_meta(name)
+        return meta['headers'], meta['units']
+
     r = re.compile('(\S+) \((\S*)\)')
     with open(filename) as f:
         l = f.readline()
@@ -94,18 +183,423 @@ def parse_table_header(filename):
         return headers, units
 
 
-def load_table(filename, columns=None):
+class SweepPack(object):
+    """ Sweep consolidated into a single zip container by pack_sweep.py
+
+    Each table is stored as a compressed column-major .npy member, so a
+    single run can be read without touching the others.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.zf = zipfile.ZipFile(filename)
+        self.index = pickle.loads(self.zf.read('index.pickle'))
+
+    def __contains__(self, name):
+        return name in self.index['tables']
+
+    @property
+    def run_info(self):
+        return pickle.loads(self.zf.read('run_info.pickle'), encoding='latin1')
+
+    def get_name(self, run_index, repeat_index):
+        return self.index['runs'][(run_index, repeat_index)]
+
+    def get_meta(self, name):
+        return self.index['tables'][name]
+
+    def load(self, name):
+        with self.zf.open(self.get_meta(name)['member']) as f:
+            return np.lib.format.read_array(f)
+
+    def load_run(self, run_index, repeat_index):
+        return self.load(self.get_name(run_index, repeat_index))
+
+packs = {}
+
+def open_pack(filename):
+    # Forked workers must not share the zip file offset with their parent
+    key = (os.getpid(), filename)
+    if key not in packs:
+        packs[key] = SweepPack(filename)
+    return packs[key]
+
+def find_pack(filename):
+    """ Locate a missing table file in a sweep pack
+
+    Returns (pack, name), or None if the table exists on disk or has not
+    been packed.
+    """
+    if os.path.exists(filename):
+        return None
+
+    outdir = os.path.dirname(filename)
+    pack_filename = os.path.join(os.path.dirname(outdir), PACK_FILENAME)
+    if not os.path.exists(pack_filename):
+        return None
+
+    pack = open_pack(pack_filename)
+    name = os.path.basename(outdir)
+    if name not in pack:
+        return None
+
+    return pack, name
+
+def column_indices(headers, columns):
+    vmap = dict(zip(headers, range(len(headers))))
+    cols = []
+    for v in columns:
+        cols.append(vmap[v])
+    return cols
+
+def get_table_cache(filename):
+    """ Filenames of the binary sidecar (data, meta) for a table file """
+    return filename + '.npy', filename + '.meta'
+
+def open_table_cache(filename):
+    """ Open the binary sidecar of a table, or return None if it is missing or stale """
+    packed = find_pack(filename)
+    if packed is not None:
+        pack, name = packed
+        return pack.load(name), pack.get_meta(name)
+
+    data_file, meta_file = get_table_cache(filename)
+    st = os.stat(filename)
+
+    try:
+        with open(meta_file, 'rb') as f:
+            meta = pickle.load(f)
+        if meta['size'] == st.st_size and meta['mtime'] == st.st_mtime_ns:
+            return np.load(data_file, mmap_mode='r'), meta
+    except (OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError):
+        pass
+
+    return None
+
+def load_table_cache(filename):
+    """ Load table as a read-only column-major memmap
+
+    The text table is transcoded once into a binary sidecar. The sidecar is
+    rebuilt whenever the size or mtime of the text file changes.
+    """
+    cached = open_table_cache(filename)
+    if cached is not None:
+        return cached
+
+    data_file, meta_file = get_table_cache(filename)
+    st = os.stat(filename)
+    headers, units = parse_table_header(filename)
+    X = np.asfortranarray(np.loadtxt(filename, ndmin=2))
+    meta = {
+        'size': st.st_size,
+        'mtime': st.st_mtime_ns,
+        'headers': headers,
+        'units': units,
+        'shape': X.shape,
+    }
+
+    try:
+        # Write to temporary files and rename, so that concurrent readers
+        # never see a partial sidecar
+        tmp = '{}.{}.tmp'.format(data_file, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, X)
+        os.replace(tmp, data_file)
+        tmp = '{}.{}.tmp'.format(meta_file, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(meta, f)
+        os.replace(tmp, meta_file)
+    except OSError:
+        # Read-only data directory, serve the parsed table directly
+        return X, meta
+
+    return np.load(data_file, mmap_mode='r'), meta
+
+def load_table(filename, columns=None, cache=None, start=None, stop=None):
+    """ Load table, or rows start:stop of it
+
+    A window of rows is read with the row index rather than parsing the
+    whole table, unless a binary cache already exists. Windows are always
+    returned as 2D (rows, columns) arrays, whole tables are squeezed like
+    np.loadtxt.
+    """
+    if cache is None:
+        cache = TABLE_CACHE
+
+    window = start is not None or stop is not None
+    packed = find_pack(filename)
+    if window and packed is None and ROW_INDEX and (not cache or open_table_cache(filename) is None):
+        return read_rows(filename, columns, start, stop)
+
+    if not cache and packed is None:
+        cols = None
+        if columns:
+            headers, units = parse_table_header(filename)
+            cols = column_indices(headers, columns)
+        if window:
+            return np.loadtxt(filename, usecols=cols, ndmin=2)[start:stop]
+        return np.loadtxt(filename, usecols=cols)
+
+    X, meta = load_table_cache(filename)
+    X = X[start:stop]
+    if columns:
+        cols = column_indices(meta['headers'], columns)
+        if cols == list(range(cols[0], cols[-1] + 1)):
+            # Contiguous columns, slice without copying
+            X = X[:, cols[0]:cols[-1] + 1]
+        else:
+            X = X[:, cols]
+
+    if window:
+        return X
+    # Same shape as np.loadtxt
+    return np.squeeze(X)
+
+def get_row_index(filename):
+    """ Filename of the row index sidecar for a table file """
+    return filename + '.rowidx'
+
+def load_row_index(filename, every=ROW_INDEX_EVERY):
+    """ Byte offsets of every every'th data row of a text table
+
+    Returns a dict with 'offsets' (offset of rows 0, every, 2*every, ...),
+    'rows' (number of complete rows) and 'size' (bytes covered). The index
+    is kept in a sidecar file and extended, rather than rebuilt, when the
+    table grows. It is rebuilt if the table is rewritten, which is detected
+    by a different inode, header or last indexed bytes.
+    """
+    index_file = get_row_index(filename)
+    with open(filename, 'rb') as f:
+        header = f.readline()
+        header_hash = content_hash(header)
+        st = os.fstat(f.fileno())
+        size = st.st_size
+
+        def tail_hash(end):
+            start = max(end - ROW_INDEX_TAIL, len(header))
+            f.seek(start)
+            return content_hash(f.read(end - start))
+
+        index = None
+        try:
+            with open(index_file, 'rb') as fi:
+                index = pickle.load(fi)
+            if (index['every'] != every or index['header'] != header_hash
+                    or index['inode'] != st.st_ino or index['size'] > size):
+                index = None
+            elif index['mtime'] == st.st_mtime_ns and index['file_size'] == size:
+                # Untouched since it was indexed
+                return index
+            elif index['tail'] != tail_hash(index['size']):
+                index = None
+        except (OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError):
+            index = None
+
+        if index is None:
+            offsets = []
+            rows = 0
+            pos = len(header)
+        else:
+            offsets = list(index['offsets'])
+            rows = index['rows']
+            pos = index['size']
+
+        # Scan for line ends from the end of the last complete row
+        f.seek(pos)
+        end = pos
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            ends = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord('\n')) + pos + 1
+            # Row k starts at the end of row k - 1
+            row_starts = np.concatenate([[end], ends[:-1]]) if len(ends) else []
+            row_numbers = np.arange(rows, rows + len(ends))
+            offsets.extend(np.asarray(row_starts, dtype=np.int64)[row_numbers % every == 0])
+            rows += len(ends)
+            if len(ends):
+                end = int(ends[-1])
+            pos += len(chunk)
+
+        tail = tail_hash(end)
+
+    index = {
+        'every': every,
+        'header': header_hash,
+        'inode': st.st_ino,
+        'mtime': st.st_mtime_ns,
+        'file_size': size,
+        'tail': tail,
+        'size': end,
+        'rows': rows,
+        'offsets': np.array(offsets, dtype=np.int64),
+    }
+
+    try:
+        tmp = '{}.{}.tmp'.format(index_file, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(index, f)
+        os.replace(tmp, index_file)
+    except OSError:
+        # Read-only data directory
+        pass
+
+    return index
+
+def open_rows(filename, start=0):
+    """ Open a text table positioned at data row start, using the row index
+
+    Returns the open file and the number of complete rows in the table.
+    """
+    index = load_row_index(filename)
+    f = open(filename)
+    k = min(start // index['every'], len(index['offsets']) - 1)
+    if k < 0:
+        f.readline() # header, empty table
+        return f, index['rows']
+    f.seek(index['offsets'][k])
+    for _ in islice(f, start - k * index['every']):
+        pass
+    return f, index['rows']
+
+def read_rows(filename, columns=None, start=None, stop=None):
+    """ Parse rows start:stop of a text table into a 2D array
+
+    Like load_table(filename, columns)[start:stop], but only the selected
+    rows are read. Negative indices count from the last complete row.
+    """
     cols = None
+    if columns:
+        headers, units = parse_table_header(filename)
+        cols = column_indices(headers, columns)
+
+    n_rows = load_row_index(filename)['rows']
+    start, stop, _ = slice(start, stop).indices(n_rows)
+    f, _ = open_rows(filename, start)
+    with f:
+        lines = list(islice(f, max(stop - start, 0)))
+    if not lines:
+        n_cols = len(cols) if cols is not None else len(parse_table_header(filename)[0])
+        return np.zeros((0, n_cols))
+    return np.loadtxt(lines, usecols=cols, ndmin=2)
+
+def count_rows(filename):
+    """ Count data rows in a table without parsing them """
+    packed = find_pack(filename)
+    if packed is not None:
+        pack, name = packed
+        return pack.get_meta(name)['shape'][0]
+
+    if ROW_INDEX:
+        # Kept up to date, so counting again is free
+        return load_row_index(filename)['rows']
+
+    n_rows = 0
+    with open(filename, 'rb') as f:
+        f.readline() # header
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            n_rows += chunk.count(b'\n')
+    return n_rows
+
+def iter_table(filename, columns=None, step=1, skip=0, stop=None):
+    """ Iterate over table rows, parsing only every step'th row
+
+    Rows are selected like poincare(X, step, skip), and stop limits the
+    number of rows read from the file.
+    """
+    step = int(step)
+    start = int(skip * step)
 
+    cols = None
     if columns:
         headers, units = parse_table_header(filename)
-        vmap = dict(zip(headers, range(len(headers))))
-        cols = []
-        for v in columns:
-            cols.append(vmap[v])
+        cols = column_indices(headers, columns)
 
-    return np.loadtxt(filename, usecols=cols)
+    if start > 0 and ROW_INDEX:
+        # Seek close to the first row instead of reading up to it
+        f, _ = open_rows(filename, start)
+        rows = islice(f, 0, None if stop is None else max(stop - start, 0), step)
+    else:
+        f = open(filename)
+        f.readline() # header
+        rows = islice(f, start, stop, step)
+
+    with f:
+        for line in rows:
+            fields = line.split()
+            if cols is not None:
+                fields = [fields[c] for c in cols]
+            yield np.array(fields, dtype=float)
+
+def iter_table_chunks(filename, columns=None, chunk_rows=CHUNK_ROWS, cache=None, start=0, stop=None):
+    """ Iterate over rows start:stop of a table in 2D arrays of up to chunk_rows rows
+
+    Memory use is bounded by the chunk size rather than the length of the
+    table. A valid binary cache is sliced directly if one exists, otherwise
+    reading starts at row start through the row index.
+    """
+    if cache is None:
+        cache = TABLE_CACHE
+
+    if cache or find_pack(filename) is not None:
+        cached = open_table_cache(filename)
+    else:
+        cached = None
+    if cached is not None:
+        X, meta = cached
+        cols = slice(None)
+        if columns:
+            cols = column_indices(meta['headers'], columns)
+        stop = len(X) if stop is None else min(stop, len(X))
+        for i in range(start, stop, chunk_rows):
+            yield np.array(X[i:min(i+chunk_rows, stop), cols])
+        return
+
+    cols = None
+    if columns:
+        headers, units = parse_table_header(filename)
+        cols = column_indices(headers, columns)
 
+    if start > 0 and ROW_INDEX:
+        f, _ = open_rows(filename, start)
+    else:
+        f = open(filename)
+        f.readline() # header
+        for _ in islice(f, start):
+            pass
+    left = None if stop is None else max(stop - start, 0)
+    with f:
+        while left is None or left > 0:
+            n = chunk_rows if left is None else min(chunk_rows, left)
+            lines = list(islice(f, n))
+            if left is not None:
+                left -= len(lines)
+            if not lines:
+                break
+            yield np.loadtxt(lines, usecols=cols, ndmin=2)
+
+def load_poincare(filename, columns=None, step=1, skip=0, stop=None, cache=None):
+    """ Load a poincare map of a table, always returned as a 2D array
+
+    Only the selected rows are parsed, so memory use depends on the size of
+    the result rather than the length of the table. A valid binary cache
+    is sliced directly if one exists.
+    """
+    if cache is None:
+        cache = TABLE_CACHE
+
+    if cache or find_pack(filename) is not None:
+        cached = open_table_cache(filename)
+    else:
+        cached = None
+    if cached is not None:
+        X, meta = cached
+        X = poincare(X[:stop], step, skip)
+        if columns:
+            X = X[:, column_indices(meta['headers'], columns)]
+        return np.array(X)
+
+    rows = list(iter_table(filename, columns, step, skip, stop))
+    if not rows:
+        n_cols = len(columns) if columns else len(parse_table_header(filename)[0])
+        return np.zeros((0, n_cols))
+    return np.array(rows)
 
 def match_vars(patterns, variables):
     var = []
@@ -125,12 +619,12 @@ def match_vars(patterns, variables):
     return var
 
 def bit_array(x, n_bits):
-    """ Convert number x to array of bits """
-    return np.array([(x & (1 << bit)) >> bit for bit in range(n_bits)])
+    """ Convert number x to array of bits, see statekeys.decode for arrays """
+    return statekeys.decode(x, n_bits).astype(int)
 
 def array_bit(a):
-    """ Convert bit array a to number """
-    return sum([(b << bit) for (bit, b) in enumerate(a)])
+    """ Convert bit array a to number, see statekeys.encode for arrays """
+    return statekeys.to_int(statekeys.encode(np.atleast_2d(a)))[0]
 
 def poincare(X, step, skip=10):
     step = int(step)
@@ -152,17 +646,55 @@ def get_tablefile(mx3_filename):
     tablefile = os.path.join(outdir, "table.txt")
     return tablefile
 
+def load_run_table(job):
+    """ Load and preprocess a single table, returning None if it is missing """
+    loader, tablefile, columns, step, skip, threshold = job
+    try:
+        if loader:
+            X = loader(tablefile, columns, step, skip)
+        elif step:
+            X = load_poincare(tablefile, columns, step, skip)
+        else:
+            X = load_table(tablefile, columns)
+    except FileNotFoundError:
+        return None
+
+    if threshold is not None:
+        X = digitize(X, threshold)
+
+    return X
+
+def load_indexed_run_table(job):
+    index, job = job
+    return index, load_run_table(job)
+
 class RunInfo(object):
+    """ Sweep run info, from a manifest (run_info.db), a pickle or a pack """
     def __init__(self, filename, load=False):
         self.filename = filename
         self.info = {}
+        self.manifest = None
         if load:
             self.load()
 
     def load(self):
-        self.info = load_run_info(self.filename)
+        manifest_filename = os.path.join(self.basedir, MANIFEST_FILENAME)
+        pack_filename = os.path.join(self.basedir, PACK_FILENAME)
+        if self.filename.endswith('.db'):
+            self.manifest = Manifest(self.filename)
+            self.info = self.manifest.get_info()
+        elif os.path.exists(self.filename) and self.filename != pack_filename:
+            self.info = load_run_info(self.filename)
+        elif os.path.exists(manifest_filename):
+            self.manifest = Manifest(manifest_filename)
+            self.info = self.manifest.get_info()
+        else:
+            self.info = open_pack(pack_filename).run_info
 
     def save(self):
+        if self.manifest:
+            self.manifest.set_info(self.info)
+            return
         with open(self.filename, 'wb') as f:
             pickle.dump(self.info, f)
 
@@ -175,20 +707,37 @@ class RunInfo(object):
 
     @property
     def run_info(self):
+        if self.manifest:
+            return self.manifest.run_info
         return self.info['run_info']
 
     @property
     def run_count(self):
+        if self.manifest:
+            return self.manifest.run_count
         return len(self.run_info)
 
     def repeat_count(self, run_index):
+        if self.manifest:
+            return self.manifest.repeat_count(run_index)
         return len(self.run_info[run_index])
 
     def repeat_counts(self):
+        if self.manifest:
+            return self.manifest.repeat_counts()
         return list(map(len, self.run_info))
 
+    def get_params(self, run_index, repeat_index):
+        if self.manifest:
+            return self.manifest.get_job(run_index, repeat_index)['params']
+        return self.run_info[run_index][repeat_index]['params']
+
     def get_mx3_filename(self, run_index, repeat_index):
-        return os.path.join(self.basedir, self.run_info[run_index][repeat_index]['filename'])
+        if self.manifest:
+            filename = self.manifest.get_filename(run_index, repeat_index)
+        else:
+            filename = self.run_info[run_index][repeat_index]['filename']
+        return os.path.join(self.basedir, filename)
 
     def get_table_filename(self, run_index, repeat_index):
         return get_tablefile(self.get_mx3_filename(run_index, repeat_index))
@@ -198,6 +747,66 @@ class RunInfo(object):
         headers, _ = parse_table_header(tablefile)
         return headers
 
-    def load_table(self, run_index, repeat_index, columns=None):
+    def load_table(self, run_index, repeat_index, columns=None, step=None, skip=0):
         tablefile = self.get_table_filename(run_index, repeat_index)
+        if step:
+            return load_poincare(tablefile, columns, step, skip)
         return load_table(tablefile, columns)
+
+    def iter_tables(self, columns=None, step=None, skip=0, threshold=None,
+                    processes=None, ordered=True, progress=False, loader=None):
+        """ Load every run/repeat table using a process pool
+
+        Yields (run_index, repeat_index, X) in sweep order, or as tables are
+        loaded if ordered is False. X is None if the table is missing.
+        Tables are digitized if a threshold is given, and loader(tablefile,
+        columns, step, skip) replaces the default table loader.
+        """
+        indices = [(i, j) for i in range(self.run_count)
+                          for j in range(self.repeat_count(i))]
+
+        # Resolve table files here, the pool feeds jobs from another thread
+        # and the manifest connection can only be used in this one
+        jobs = [((i, j), (loader, self.get_table_filename(i, j), columns, step, skip, threshold))
+                for i, j in indices]
+
+        if processes == 1:
+            results = map(load_indexed_run_table, jobs)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes)
+            imap = pool.imap if ordered else pool.imap_unordered
+            results = imap(load_indexed_run_table, jobs)
+
+        try:
+            for n, ((i, j), X) in enumerate(results, start=1):
+                if progress:
+                    print("\rLoaded {}/{} tables".format(n, len(indices)), end='', flush=True)
+                yield i, j, X
+        finally:
+            if pool:
+                pool.terminate()
+            if progress:
+                print("")
+
+    def iter_runs(self, columns=None, step=None, skip=0, threshold=None,
+                  processes=None, ordered=True, progress=False, loader=None):
+        """ Load all repeats of every run using a process pool
+
+        Yields (run_index, X) where X stacks the tables of all repeats, or
+        None if any of them is missing (incomplete run).
+        """
+        pending = {}
+        tables = self.iter_tables(columns, step, skip, threshold, processes,
+                                  ordered, progress, loader)
+        for i, j, X in tables:
+            Xs = pending.setdefault(i, [])
+            Xs.append(X)
+            if len(Xs) < self.repeat_count(i):
+                continue
+
+            del pending[i]
+            if any(Xi is None for Xi in Xs):
+                yield i, None
+            else:
+                yield i, np.array(Xs)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import os
+import glob
+import pickle
+import zipfile
+import numpy as np
+from mx3util import RunInfo, PACK_FILENAME, parse_table_header, open_table_cache
+
+def load_full_table(tablefile):
+    # Reuse a valid binary cache if there is one
+    cached = open_table_cache(tablefile)
+    if cached is not None:
+        X, meta = cached
+        return X, meta['headers'], meta['units']
+
+    headers, units = parse_table_header(tablefile)
+    X = np.loadtxt(tablefile, ndmin=2)
+    return X, headers, units
+
+def pack_sweep(run, filename, delete=False):
+    index = {
+        'tables': {},
+        'runs': {},
+    }
+    packed = []
+
+    tmp = '{}.{}.tmp'.format(filename, os.getpid())
+    with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        zf.writestr('run_info.pickle', pickle.dumps(dict(run.info, run_info=run.run_info)))
+
+        for run_index in range(run.run_count):
+            for repeat_index in range(run.repeat_count(run_index)):
+                tablefile = run.get_table_filename(run_index, repeat_index)
+                if not os.path.exists(tablefile):
+                    print("  missing {}".format(tablefile))
+                    continue
+
+                X, headers, units = load_full_table(tablefile)
+                X = np.asfortranarray(X)
+
+                name = os.path.basename(os.path.dirname(tablefile))
+                member = 'tables/{}.npy'.format(name)
+                with zf.open(member, 'w', force_zip64=True) as f:
+                    np.lib.format.write_array(f, X)
+
+                index['tables'][name] = {
+                    'run_index': run_index,
+                    'repeat_index': repeat_index,
+                    'member': member,
+                    'headers': headers,
+                    'units': units,
+                    'shape': X.shape,
+                }
+                index['runs'][(run_index, repeat_index)] = name
+                packed.append(tablefile)
+                print(".", end='', flush=True)
+
+        zf.writestr('index.pickle', pickle.dumps(index))
+
+    os.replace(tmp, filename)
+    print("")
+    print("Packed {} tables into {}".format(len(packed), filename))
+
+    if delete:
+        for tablefile in packed:
+            sidecars = glob.glob(glob.escape(tablefile) + '.states-*')
+            for f in [tablefile, tablefile + '.npy', tablefile + '.meta', tablefile + '.rowidx'] + sidecars:
+                if os.path.exists(f):
+                    os.remove(f)
+            outdir = os.path.dirname(tablefile)
+            if not os.listdir(outdir):
+                os.rmdir(outdir)
+        print("Removed {} table files".format(len(packed)))
+
+def main(args):
+    run = RunInfo(args.filename, load=True)
+    output = args.output
+    if not output:
+        output = os.path.join(run.basedir, PACK_FILENAME)
+
+    print("Packing {} runs from {}...".format(run.run_count, args.filename))
+    pack_sweep(run, output, args.delete)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Pack sweep tables into a single file')
+    parser.add_argument('-o', '--output', metavar='FILE',
+            help='output file (default: {} next to run_info)'.format(PACK_FILENAME))
+    parser.add_argument('-d', '--delete', action='store_true',
+            help='remove table files once packed')
+    parser.add_argument('filename', help='run_info file')
+
+    args = parser.parse_args()
+    main(args)
@@ -4,7 +4,8 @@ import re
 import numpy as np
 from numpy.linalg import norm
 import matplotlib.pyplot as plt
-from mx3util import parse_table_header, load_table, match_vars
+from mx3util import parse_table_header, match_vars, count_rows, iter_table_chunks, CHUNK_ROWS
+from decimate import decimate
 
 line_highlight = False
 
@@ -23,6 +24,101 @@ funcs = {
     'atan': func_atan
 }
 
+class TableLines(object):
+    """ Lines of table columns over the first one, decimated to the
+    resolution of the axes
+
+    Only decimated points are kept in memory. The table is read in chunks
+    that are decimated as they come, and whenever the x limits change (zoom,
+    pan) the rows in view are read again through the row index and
+    decimated to the new view. transform(X) maps table columns to the x
+    column followed by the y columns.
+    """
+    def __init__(self, filename, columns, transform, start=None, stop=None, step=None,
+                 method='minmax', n_points=None):
+        self.filename = filename
+        self.columns = columns
+        self.transform = transform
+        self.start, self.stop, _ = slice(start, stop).indices(count_rows(filename))
+        self.step = step or 1
+        self.method = method
+        self.n_points = n_points
+        self.lines = []
+        # Row numbers and x of the points read so far, to find visible rows
+        self.index_rows = np.zeros(0, dtype=np.int64)
+        self.index_x = np.zeros(0)
+        self.sorted = True
+        self.view = None
+
+    def n_out(self, ax):
+        if self.n_points:
+            return self.n_points
+        return 2 * int(ax.get_window_extent().width)
+
+    def plot(self, ax, column, fn=None, *args, **kwargs):
+        """ Add a line of y column column, mapped by fn if given, drawn by load """
+        line, = ax.plot([], [], *args, **kwargs)
+        self.lines.append((line, column, fn))
+        return line
+
+    def read(self, start, stop, n_out):
+        """ Decimated (x, y) of each line from rows start:stop """
+        # Chunks start on poincare rows, so that the stride carries over
+        chunk_rows = max(CHUNK_ROWS // self.step, 1) * self.step
+        points = [([], []) for _ in self.lines]
+        index_rows, index_x = [], []
+        row = start
+        for X in iter_table_chunks(self.filename, self.columns, chunk_rows, start=start, stop=stop):
+            rows = np.arange(row, row + len(X), self.step)
+            n_chunk = max(int(n_out * len(X) / max(stop - start, 1)), 4)
+            row += len(X)
+            X = self.transform(X[::self.step])
+            x = X[:,0]
+            for (line, column, fn), (xs, ys) in zip(self.lines, points):
+                y = X[:,column] if fn is None else fn(X[:,column])
+                i = decimate(x, y, n_chunk, self.method)
+                xs.append(x[i])
+                ys.append(y[i])
+                index_rows.append(rows[i])
+                index_x.append(x[i])
+
+        rows = np.concatenate([self.index_rows] + index_rows)
+        x = np.concatenate([self.index_x] + index_x)
+        self.index_rows, i = np.unique(rows, return_index=True)
+        self.index_x = x[i]
+        return [(np.concatenate(xs or [[]]), np.concatenate(ys or [[]])) for xs, ys in points]
+
+    def rows(self, xlim):
+        if not self.sorted or len(self.index_x) == 0:
+            return self.start, self.stop
+        # One point beyond each side, so lines continue to the edges
+        lo = max(np.searchsorted(self.index_x, min(xlim), 'right') - 1, 0)
+        hi = min(np.searchsorted(self.index_x, max(xlim), 'left'), len(self.index_x) - 1)
+        return max(self.index_rows[lo], self.start), min(self.index_rows[hi] + 1, self.stop)
+
+    def view_of(self, ax):
+        return self.rows(ax.get_xlim()) + (self.n_out(ax),)
+
+    def load(self, ax):
+        """ Draw the lines over all rows """
+        for (line, _, _), data in zip(self.lines, self.read(self.start, self.stop, self.n_out(ax))):
+            line.set_data(*data)
+            line.axes.relim()
+            line.axes.autoscale_view()
+        # Visible rows are only found by bisection if x is sorted
+        self.sorted = bool(np.all(np.diff(self.index_x) >= 0))
+
+    def update(self, ax):
+        view = self.view_of(ax)
+        if view == self.view:
+            return
+        self.view = view
+        # Align the window to the poincare rows
+        start = view[0] - (view[0] - self.start) % self.step
+        for (line, _, _), data in zip(self.lines, self.read(start, view[1], view[2])):
+            line.set_data(*data)
+        ax.figure.canvas.draw_idle()
+
 def parse_var(var, headers):
     m = re.match(r'(\w+)\((.*)\)', var)
     if m:
@@ -58,32 +154,24 @@ def main(args):
     # flatten
     variables = [v for var in varmap for v in var[2:]]
 
-    t0 = args.t0
-    t1 = args.t1
-    data = load_table(args.filename, variables)
-    data = data[t0:t1]
+    def transform(data):
+        """ Apply funcs to the table columns of varmap """
+        data2 = []
+        i = 0
+        for var in varmap:
+            fn = var[1]
+            count = len(var[2:])
+            d = data[:,i:i+count]
+            if fn:
+                d = fn(d)
+            else:
+                assert d.shape[1] == 1
+            data2.append(d)
+            i += count
+        return np.concatenate(data2, axis=1)
 
     xlabel = args.x
 
-    if args.poincare:
-        data = data[::args.poincare]
-
-    # Apply funcs
-    data2 = []
-    i = 0
-    for var in varmap:
-        fn = var[1]
-        count = len(var[2:])
-        d = data[:,i:i+count]
-        if fn:
-            d = fn(d)
-        else:
-            assert d.shape[1] == 1
-        data2.append(d)
-        i += count
-
-    data2 = np.concatenate(data2, axis=1)
-
     n_rows = 1
     if args.digitize:
         n_rows += 1
@@ -91,20 +179,23 @@ def main(args):
     axes = np.atleast_1d(axes)
     axes = axes.flatten()
 
-    x = data2[:,0]
+    # Only rows t0:t1 are read from the table
+    method = None if args.decimate == 'none' else args.decimate
+    decimated = TableLines(args.filename, variables, transform, args.t0 or None, args.t1,
+                           args.poincare, method, args.points)
     lines = []
     dlines = []
     for i, var in enumerate(varmap[1:], start=1):
-        d = data2[:,i]
         label = var[0]
-        line, = axes[0].plot(x, d, label=label)
+        line = decimated.plot(axes[0], i, label=label)
         lines.append(line)
 
         dlines.append(None)
         if args.digitize:
-            dd = np.where(d > 0, 1, 0)
-            dlines[-1], = axes[1].plot(x, dd - 1.1*(i - 1), color=line.get_color())
+            fn = lambda d, i=i: np.where(d > 0, 1, 0) - 1.1*(i - 1)
+            dlines[-1] = decimated.plot(axes[1], i, fn, color=line.get_color())
 
+    decimated.load(axes[0])
 
     # Shrink current axis by 10%
     for ax in axes:
@@ -149,6 +240,12 @@ def main(args):
         fig.canvas.draw()
 
     fig.canvas.mpl_connect('pick_event', onpick)
+    if method:
+        # Settle the initial autoscaled limits first, the callback must only
+        # follow the user. Axes share x, so one callback covers all of them
+        decimated.view = decimated.view_of(axes[0])
+        # Callbacks hold bound methods weakly, a lambda keeps decimated alive
+        axes[0].callbacks.connect('xlim_changed', lambda ax: decimated.update(ax))
 
     if args.output:
         plt.savefig(args.output)
@@ -176,6 +273,10 @@ if __name__ == '__main__':
                         help='set ylim')
     parser.add_argument('-p', '--poincare', type=int, metavar='N',
                         help='apply poincare map (plot every N samples)')
+    parser.add_argument('--decimate', choices=['minmax', 'lttb', 'none'], default='minmax',
+                        help='reduce lines to about --points points (default: %(default)s)')
+    parser.add_argument('--points', type=int, metavar='N',
+                        help='points per line when decimating (default: twice the plot width in pixels)')
     parser.add_argument('var', nargs='*',
                         help='list of variables to plot')
 
@@ -0,0 +1,111 @@
+import os
+import shutil
+
+class ResultStore(object):
+    """ Content-addressed store of mumax3 .out directories shared between sweeps
+
+    Results are keyed by the hash of the rendered job script. Files are hard
+    linked between the store and the sweep directories where possible, so
+    evicting an entry never removes data from a sweep. Entries are evicted in
+    least recently used order when the store grows beyond max_size bytes.
+    """
+    def __init__(self, root, max_size=None):
+        self.root = root
+        self.max_size = max_size
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def path(self, h):
+        return os.path.join(self.root, h[:2], h + '.out')
+
+    def lookup(self, h):
+        """ Return path of stored result for hash h, or None """
+        path = self.path(h)
+        if not os.path.isdir(path):
+            return None
+        # Mark as recently used
+        os.utime(path)
+        return path
+
+    def checkout(self, h, outdir):
+        """ Link stored result for hash h into outdir """
+        path = self.lookup(h)
+        assert path, "No result for {}".format(h)
+        if os.path.exists(outdir):
+            shutil.rmtree(outdir)
+        link_tree(path, outdir)
+
+    def add(self, h, outdir):
+        """ Add finished result in outdir under hash h """
+        path = self.path(h)
+        if os.path.isdir(path):
+            os.utime(path)
+            return
+
+        parent = os.path.dirname(path)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+
+        # Link into a temporary directory and rename, so that partial entries
+        # are never visible
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        link_tree(outdir, tmp)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Added concurrently by someone else
+            shutil.rmtree(tmp)
+
+    def entries(self):
+        """ List (last used, size, path) of all entries """
+        entries = []
+        for d in os.listdir(self.root):
+            subdir = os.path.join(self.root, d)
+            if not os.path.isdir(subdir):
+                continue
+            for e in os.listdir(subdir):
+                if not e.endswith('.out'):
+                    continue
+                path = os.path.join(subdir, e)
+                entries.append((os.stat(path).st_mtime, tree_size(path), path))
+        return entries
+
+    def evict(self):
+        """ Remove least recently used entries until the store fits in max_size """
+        if self.max_size is None:
+            return 0
+
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        n_evicted = 0
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(path)
+            total -= size
+            n_evicted += 1
+
+        return n_evicted
+
+def link_tree(src, dst):
+    """ Recreate directory tree src at dst using hard links, copying if that fails """
+    for root, dirs, files in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.exists(target):
+            os.makedirs(target)
+        for f in files:
+            s = os.path.join(root, f)
+            d = os.path.join(target, f)
+            try:
+                os.link(s, d)
+            except OSError:
+                shutil.copy2(s, d)
+
+def tree_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            size += os.stat(os.path.join(root, f)).st_size
+    return size
@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 import os
-import time
 import argparse
 import re
 import itertools
-import pickle
 import numpy as np
 from collections import OrderedDict
-from mx3util import gen_job, run_local, run_dist, StoreKeyValue
+from mx3util import gen_jobs, run_dist, StoreKeyValue, get_tablefile, find_pack
+from manifest import Manifest, MANIFEST_FILENAME
+from resultstore import ResultStore
+from scheduler import LocalScheduler, SlurmArray
+from monitor import CompletionMonitor
 
 n_gpus_dist = 2
 
@@ -46,8 +48,27 @@ def parse_sweep_spec(specs, ctx=None):
 def enumerate_sweep_spec(sweep_spec):
     return list(itertools.product(*sweep_spec))
 
+def update_status(manifest, jobs, exit_code, store=None, hashes=None):
+    """ Mark jobs given as (run_index, repeat_index, mx3 file) finished or failed
+
+    Finished results are added to the result store, if any.
+    """
+    finished = []
+    failed = []
+    for i, j, job in jobs:
+        if exit_code == 0 and os.path.exists(get_tablefile(job)):
+            finished.append((i, j))
+            if store:
+                store.add(hashes[(i, j)], os.path.dirname(get_tablefile(job)))
+        else:
+            failed.append((i, j))
+    manifest.set_status(finished, 'finished', exit_code)
+    manifest.set_status(failed, 'failed', exit_code)
+
 def main(args):
     queue = []
+    jobs = []
+    manifest_jobs = []
 
     sweep_spec = parse_sweep_spec(args.sweep)
     sweep_list = enumerate_sweep_spec(sweep_spec)
@@ -61,11 +82,11 @@ def main(args):
 
     base, ext = os.path.splitext(os.path.basename(args.template))
 
-    info = []
-
-    if os.path.exists(args.outdir):
+    if args.resume:
+        print("Resuming sweep in {}".format(args.outdir))
+    elif os.path.exists(args.outdir):
         print("WARNING: Path exists: {}".format(args.outdir))
-    else:
+    if not os.path.exists(args.outdir):
         os.makedirs(args.outdir)
 
     repeat_specs = []
@@ -74,7 +95,6 @@ def main(args):
     for i, sweep_params in enumerate(sweep_list):
         params = dict(args.param)
         params.update(sweep_params)
-        info.append([])
 
         repeat_spec = parse_sweep_spec(repeat, ctx=params)
         repeat_list = enumerate_sweep_spec(repeat_spec)
@@ -91,14 +111,18 @@ def main(args):
             runparams = dict(params)
             runparams.update(repeat_params)
             out = os.path.join(args.outdir, outfile)
-            gen_job(args.template, out, **runparams)
             queue.append(out)
-            d = {'params': runparams, 'filename': outfile}
-            info[-1].append(d)
+            jobs.append((i, j, out))
+            manifest_jobs.append((i, j, outfile, runparams))
+
+    info_filename = os.path.join(args.outdir, MANIFEST_FILENAME)
+    manifest = Manifest(info_filename)
+    previous = manifest.get_states() if args.resume else {}
 
+    results = gen_jobs(args.template, [(out, p) for out, (_, _, _, p) in zip(queue, manifest_jobs)],
+                       processes=args.jobs, keep_unchanged=args.resume)
     print("Generated {} jobs in {}".format(len(queue), args.outdir))
 
-    info_filename = os.path.join(args.outdir, 'run_info.pickle')
     run_info = {
         'type': 'sweep',
         'args': args,
@@ -107,26 +131,109 @@ def main(args):
         'repeat': repeat,
         'repeat_specs': repeat_specs,
         'repeat_lists': repeat_lists,
-        'run_info': info
     }
-    with open(info_filename, 'wb') as f:
-        pickle.dump(run_info, f)
+    manifest.set_info(run_info)
+    if not args.resume:
+        manifest.clear_jobs()
+    # Index the parameters given on the command line, not template defaults
+    index_keys = list(OrderedDict.fromkeys(list(args.param.keys()) +
+                                           [sp[0][0] for sp in sweep_spec] + list(repeat.keys())))
+    manifest.add_jobs([job + (h,) for job, (h, _) in zip(manifest_jobs, results)], index_keys)
+
+    jobs_all = list(jobs)
+    if args.resume:
+        # Keep jobs with unchanged scripts that the manifest knows to have
+        # finished. A table alone may have been left half written by a
+        # killed mumax3, jobs without a manifest record are run again.
+        remaining = []
+        for job, (h, written) in zip(jobs, results):
+            i, j, out = job
+            status, prev_hash = previous.get((i, j), (None, None))
+            # Tables of packed sweeps live in the sweep pack
+            tablefile = get_tablefile(out)
+            complete = (status == 'finished' and prev_hash in (h, None) and not written and
+                        (os.path.exists(tablefile) or find_pack(tablefile) is not None))
+            if not complete:
+                remaining.append(job)
+
+        print("Resume: {} of {} jobs already complete".format(len(jobs) - len(remaining), len(jobs)))
+        jobs = remaining
+        queue = [out for _, _, out in jobs]
+        manifest.set_status([(i, j) for i, j, _ in jobs], 'queued')
+
+    store = None
+    hashes = {(i, j): h for (i, j, _), (h, _) in zip(jobs_all, results)}
+    if args.store:
+        store = ResultStore(args.store, int(args.store_size * 1e9) if args.store_size else None)
+
+        # Link results of identical jobs from earlier sweeps
+        remaining = []
+        hits = []
+        for job in jobs:
+            i, j, out = job
+            if store.lookup(hashes[(i, j)]):
+                store.checkout(hashes[(i, j)], os.path.dirname(get_tablefile(out)))
+                hits.append((i, j))
+            else:
+                remaining.append(job)
+
+        print("Result store: {} of {} jobs found in {}".format(len(hits), len(jobs), args.store))
+        manifest.set_status(hits, 'finished', 0)
+        jobs = remaining
+        queue = [out for _, _, out in jobs]
+
+    if args.run == 'local' and jobs:
+        devices = args.devices.split(',') if args.devices else None
+        scheduler = LocalScheduler(args.gpus, timeout=args.timeout, retries=args.retries,
+                                   devices=devices)
+        job_index = {out: (i, j, out) for i, j, out in jobs}
+
+        def on_finish(job, exit_code):
+            update_status(manifest, [job_index[job]], exit_code, store, hashes)
+
+        manifest.set_status([(i, j) for i, j, _ in jobs], 'running')
+        exit_codes = scheduler.run(queue, on_finish)
+        n_failed = sum(1 for c in exit_codes.values() if c != 0)
+        if n_failed:
+            print("WARNING: {} of {} jobs failed".format(n_failed, len(exit_codes)))
 
-    if args.run == 'local':
-        run_local(queue)
+    elif args.run == 'dist' and args.array:
+        # Submit all jobs as one job array, n_gpus_dist jobs per array task
+        job_script = os.path.join(args.outdir, base + '-array.slurm.sh')
+        array = SlurmArray(queue, job_script, n_gpus_dist, args.throttle)
+        array.submit()
+        manifest.set_status([(i, j) for i, j, _ in jobs], 'running')
+        job_index = {out: (i, j, out) for i, j, out in jobs}
+
+        def on_finish(task_jobs, state, exit_code):
+            if exit_code is None:
+                exit_code = 0 if state == 'COMPLETED' else 1
+            update_status(manifest, [job_index[job] for job in task_jobs], exit_code, store, hashes)
+
+        array.wait(args.poll_interval, on_finish)
 
     elif args.run == 'dist':
-        # Submit jobs in chunks of n_gpus_dist
-        procs = []
-        while queue:
-            jobs = queue[0:n_gpus_dist]
-            del queue[0:n_gpus_dist]
-            p = run_dist(jobs, wait=False)
-            procs.append(p)
+        # Submit jobs in chunks of n_gpus_dist, and update the manifest as
+        # soon as each chunk completes
+        monitor = CompletionMonitor()
+        while jobs:
+            chunk = jobs[0:n_gpus_dist]
+            del jobs[0:n_gpus_dist]
+            p = run_dist([job for _, _, job in chunk], wait=False)
+            manifest.set_status([(i, j) for i, j, _ in chunk], 'running')
+            monitor.watch_process(p, lambda exit_code, chunk=chunk:
+                    update_status(manifest, chunk, exit_code, store, hashes))
 
         # Wait for all jobs to finish
-        while not all([p.poll() is not None for p in procs]):
-            time.sleep(1)
+        monitor.run()
+        monitor.close()
+
+    if store:
+        n_evicted = store.evict()
+        if n_evicted:
+            print("Evicted {} results from {}".format(n_evicted, store.root))
+
+    manifest.close()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run mx3 job')
@@ -140,6 +247,29 @@ if __name__ == '__main__':
                         help='repeat each experiment N times (default: %(default)s)')
     parser.add_argument('-ns', '--repeat-spec', action=StoreKeyValue, metavar='key=SPEC',
                         help='repeat each according to key=SPEC')
+    parser.add_argument('-g', '--gpus', type=int, default=1, metavar='N',
+                        help='number of local jobs to run concurrently, one per GPU (default: %(default)s)')
+    parser.add_argument('--devices', metavar='ID,...',
+                        help='device IDs of local slots (default: 0..N-1)')
+    parser.add_argument('--timeout', type=float, metavar='SECONDS',
+                        help='kill local jobs running longer than SECONDS')
+    parser.add_argument('--retries', type=int, default=0, metavar='N',
+                        help='retry failed local jobs N times (default: %(default)s)')
+    parser.add_argument('-a', '--array', action='store_true',
+                        help='submit distributed jobs as a single Slurm job array')
+    parser.add_argument('--throttle', type=int, metavar='N',
+                        help='run at most N array tasks at once')
+    parser.add_argument('--poll-interval', type=float, default=10, metavar='SECONDS',
+                        help='interval between job array status polls (default: %(default)s)')
+    parser.add_argument('--resume', action='store_true',
+                        help='only run jobs that have not completed in outdir')
+    parser.add_argument('--store', metavar='DIR', default=os.environ.get('MX3_RESULT_STORE'),
+                        help='share results of identical jobs through result store DIR '
+                             '(default: $MX3_RESULT_STORE)')
+    parser.add_argument('--store-size', type=float, metavar='GB',
+                        help='evict least recently used results beyond GB gigabytes')
+    parser.add_argument('-j', '--jobs', type=int, default=None, metavar='N',
+                        help='generate job files using N processes (default: all cores)')
     parser.add_argument('template', help='job template')
     parser.add_argument('outdir', help='output directory for job files')
 
@@ -0,0 +1,298 @@
+import os
+import time
+import queue
+import threading
+import subprocess
+from mx3util import gen_job
+
+ARRAY_JOB_SCRIPT_TEMPLATE = 'mumax3-array.slurm.sh'
+
+# Slurm job states of tasks that will not run any more
+SLURM_DONE_STATES = [
+    'BOOT_FAIL', 'CANCELLED', 'COMPLETED', 'DEADLINE', 'FAILED',
+    'NODE_FAIL', 'OUT_OF_MEMORY', 'PREEMPTED', 'TIMEOUT',
+]
+
+def slurm_job_active(job_id, squeue='squeue', retries=3, retry_interval=10):
+    """ Return True if Slurm job job_id is still pending or running
+
+    A job squeue no longer knows about is done. Other squeue failures, such
+    as slurmctld timeouts, say nothing about the job and are retried up to
+    retries times before the error is raised.
+    """
+    cmd = [squeue, '-h', '-j', str(job_id), '-o', '%i']
+    for attempt in range(retries + 1):
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if p.returncode == 0:
+            return bool(p.stdout.strip())
+        if b'Invalid job id' in p.stderr:
+            return False
+        print("squeue failed: {}".format(p.stderr.decode().strip()))
+        if attempt < retries:
+            time.sleep(retry_interval)
+    raise subprocess.CalledProcessError(p.returncode, cmd, p.stdout, p.stderr)
+
+def array_tasks(spec):
+    """ Task IDs of a job array task spec, e.g. "7" or "[4-6,9%8]"
+
+    Pending tasks are listed as a bracketed range (with the throttle after
+    %), which applies to every task in it.
+    """
+    spec = spec.strip('[]').partition('%')[0]
+    tasks = []
+    for part in spec.split(','):
+        first, _, last = part.partition('-')
+        if not first.isdigit() or (last and not last.isdigit()):
+            continue
+        tasks.extend(range(int(first), int(last or first) + 1))
+    return tasks
+
+class LocalScheduler(object):
+    """ Run jobs on a number of local slots, typically one per GPU
+
+    Each slot runs one job at a time as `cmd job`, with the slot's device ID
+    in the environment variable device_env. Jobs that fail or exceed the
+    timeout (seconds) are retried up to retries times. Output of each job is
+    captured in <job>.stdout and <job>.stderr next to the job file.
+    """
+    def __init__(self, slots=1, cmd=None, timeout=None, retries=0,
+                 devices=None, device_env='CUDA_VISIBLE_DEVICES', capture=True):
+        self.cmd = list(cmd) if cmd else ['mumax3']
+        self.timeout = timeout
+        self.retries = retries
+        self.device_env = device_env
+        self.capture = capture
+
+        if devices is None:
+            devices = list(range(slots))
+        self.devices = devices
+
+        self.queue = queue.Queue()
+        self.results = queue.Queue()
+        self.attempts = {}
+        # Updated by submit and poll, which may run in different threads
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        for device in self.devices:
+            t = threading.Thread(target=self.worker, args=(device,))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def submit(self, jobs):
+        for job in jobs:
+            self.attempts[job] = 0
+            with self.pending_lock:
+                self.pending += 1
+            self.queue.put(job)
+
+    def worker(self, device):
+        env = dict(os.environ)
+        env[self.device_env] = str(device)
+
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            self.results.put((job, self.execute(job, env)))
+
+    def execute(self, job, env):
+        base, _ = os.path.splitext(job)
+        stdout = stderr = subprocess.DEVNULL
+        opened = []
+
+        try:
+            if self.capture:
+                stdout = open(base + '.stdout', 'w')
+                opened.append(stdout)
+                stderr = open(base + '.stderr', 'w')
+                opened.append(stderr)
+
+            p = subprocess.Popen(self.cmd + [job], stdout=stdout, stderr=stderr, env=env)
+            try:
+                return p.wait(self.timeout)
+            except subprocess.TimeoutExpired:
+                p.kill()
+                p.wait()
+                return None
+        except OSError as e:
+            if stderr in opened:
+                stderr.write("{}\n".format(e))
+            else:
+                print("{}: {}".format(job, e))
+            return None
+        finally:
+            for f in opened:
+                f.close()
+
+    def poll(self, timeout=None):
+        """ Wait up to timeout seconds for jobs to finish
+
+        Returns list of (job, exit code) for jobs that are done, including
+        retries. The exit code is None if the job timed out or could not be
+        started.
+        """
+        done = []
+        try:
+            item = self.results.get(timeout=timeout)
+            while True:
+                job, exit_code = item
+                if exit_code != 0 and self.attempts[job] < self.retries:
+                    self.attempts[job] += 1
+                    print("Retrying {} (exit code {}, attempt {})".format(
+                        job, exit_code, self.attempts[job] + 1))
+                    self.queue.put(job)
+                else:
+                    with self.pending_lock:
+                        self.pending -= 1
+                    done.append((job, exit_code))
+                item = self.results.get_nowait()
+        except queue.Empty:
+            pass
+
+        return done
+
+    def run(self, jobs, on_finish=None):
+        """ Run jobs and wait for all of them, returning {job: exit code} """
+        exit_codes = {}
+        self.start()
+        self.submit(jobs)
+        try:
+            while self.pending:
+                for job, exit_code in self.poll():
+                    exit_codes[job] = exit_code
+                    if on_finish:
+                        on_finish(job, exit_code)
+        finally:
+            self.stop()
+
+        return exit_codes
+
+class SlurmArray(object):
+    """ Submit jobs as a single Slurm job array
+
+    Jobs are grouped jobs_per_task at a time into array tasks listed in a job
+    list file, and at most throttle tasks run at once. Completion of all
+    tasks is tracked with one sacct (or squeue) call per poll. The sbatch,
+    sacct and squeue commands can be replaced by local stand-ins.
+    """
+    def __init__(self, jobs, job_script, jobs_per_task=1, throttle=None,
+                 template=ARRAY_JOB_SCRIPT_TEMPLATE,
+                 sbatch='sbatch', sacct='sacct', squeue='squeue'):
+        self.tasks = [jobs[i:i+jobs_per_task] for i in range(0, len(jobs), jobs_per_task)]
+        self.job_script = job_script
+        self.jobs_per_task = jobs_per_task
+        self.throttle = throttle
+        self.template = template
+        self.sbatch = sbatch
+        self.sacct = sacct
+        self.squeue = squeue
+        self.job_id = None
+        self.done = {}
+
+    def submit(self):
+        base = self.job_script
+        if base.endswith('.slurm.sh'):
+            base = base[:-len('.slurm.sh')]
+        job_list = base + '.jobs'
+        with open(job_list, 'w') as f:
+            for task in self.tasks:
+                f.write(" ".join(task) + "\n")
+
+        array = "0-{}".format(len(self.tasks) - 1)
+        if self.throttle:
+            array += "%{}".format(self.throttle)
+
+        gen_job(self.template, self.job_script, array=array, job_list=job_list,
+                jobs_per_task=self.jobs_per_task,
+                job_script_dir=os.path.dirname(self.job_script),
+                job_script_name=os.path.basename(base))
+
+        out = subprocess.check_output([self.sbatch, '--parsable', self.job_script])
+        # --parsable prints "jobid" or "jobid;cluster"
+        self.job_id = out.decode().strip().split(';')[0]
+        print("Submitted job array {} ({} tasks)".format(self.job_id, len(self.tasks)))
+
+        return self.job_id
+
+    def query_sacct(self):
+        """ Return {task: (state, exit code)} from sacct, or None if unavailable """
+        cmd = [self.sacct, '-j', self.job_id, '-n', '-P', '-X', '--format=JobID,State,ExitCode']
+        try:
+            out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+        states = {}
+        for line in out.decode().splitlines():
+            job_id, state, exit_code = line.split('|')
+            array_id, _, task = job_id.partition('_')
+            # e.g. "CANCELLED by 1234"
+            state = state.split()[0] if state else state
+            for t in array_tasks(task):
+                states[t] = (state, int(exit_code.split(':')[0]))
+        return states
+
+    def query_squeue(self):
+        """ Return {task: (state, exit code)} for tasks no longer in squeue
+
+        The exit code of those tasks is not known and returned as None. If
+        squeue fails for another reason, nothing is returned and the next
+        poll tries again.
+        """
+        cmd = [self.squeue, '-h', '-r', '-j', self.job_id, '-o', '%i']
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if p.returncode != 0:
+            if b'Invalid job id' in p.stderr:
+                # The array has left the queue, no task is active
+                out = b''
+            else:
+                print("squeue failed: {}".format(p.stderr.decode().strip()))
+                return {}
+        else:
+            out = p.stdout
+        active = set()
+        for line in out.decode().split():
+            task = line.partition('_')[2]
+            if task.isdigit():
+                active.add(int(task))
+        return {task: ('COMPLETED', None) for task in range(len(self.tasks))
+                if task not in active}
+
+    def poll(self):
+        """ Return list of (jobs, state, exit code) for tasks finished since last poll """
+        states = self.query_sacct()
+        if states is None:
+            states = self.query_squeue()
+
+        finished = []
+        for task, (state, exit_code) in sorted(states.items()):
+            if task in self.done or state not in SLURM_DONE_STATES:
+                continue
+            self.done[task] = (state, exit_code)
+            finished.append((self.tasks[task], state, exit_code))
+
+        return finished
+
+    @property
+    def pending(self):
+        return len(self.tasks) - len(self.done)
+
+    def wait(self, interval=10, on_finish=None):
+        """ Poll every interval seconds until all tasks are done """
+        while self.pending:
+            for jobs, state, exit_code in self.poll():
+                if on_finish:
+                    on_finish(jobs, state, exit_code)
+            if self.pending:
+                time.sleep(interval)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark StateSpaceSearch bookkeeping by replaying recorded edgelists
+through the analysis step, without running any simulations.
+"""
+import os
+import time
+import contextlib
+import numpy as np
+from run_sss import StateSpaceSearch
+from edgestore import read_edges, find_edgelist
+
+# In any format, see find_edgelist
+edgelists = [
+        "si3x3-0pst-edgelist",
+        "si3x3-1pst-edgelist",
+        "si3x3-2pst-edgelist",
+        "si3x3-3pst-edgelist",
+]
+
+def load_transitions(filename):
+    """ Group edgelist rows by source configuration """
+    edges = read_edges(filename)
+    configs = edges['from'].astype(int)
+    states = edges['to'].astype(int)
+    phis = edges['phi']
+
+    # Split into runs of equal source configuration, in file order
+    bounds = np.flatnonzero(np.diff(configs)) + 1
+    starts = np.concatenate([[0], bounds])
+    ends = np.concatenate([bounds, [len(configs)]])
+    return {configs[a]: (states[a:b], phis[a:b]) for a, b in zip(starts, ends)}
+
+def legacy_analyze(sss, config, states, phis):
+    """ List based frontier as used before the bitset """
+    for s in states.tolist():
+        if s not in sss.finished and s not in sss.queue and s not in sss.running:
+            sss.queue.append(s)
+    sss.edgelist.append((config, states, phis))
+    sss.n_edges += len(states)
+
+def replay(transitions, initial, legacy=False):
+    sss = StateSpaceSearch('bench.mx3', initial, {}, '.', runtype='dist')
+    if legacy:
+        sss.queue = [initial]
+        sss.running = []
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        t0 = time.time()
+        while sss.queue:
+            config = sss.queue.pop(0) if legacy else sss.queue.popleft()
+            sss.finished.append(config)
+            if config not in transitions:
+                continue
+            states, phis = transitions[config]
+            if legacy:
+                legacy_analyze(sss, config, states, phis)
+            else:
+                sss.analyze_states(config, states, phis)
+        dt = time.time() - t0
+
+    return len(sss.finished), sss.n_edges, dt
+
+def main(args):
+    for edgelist in args.edgelists:
+        transitions = load_transitions(edgelist)
+        initial = int(read_edges(edgelist)['from'][0])
+
+        n_states, n_edges, dt = replay(transitions, initial)
+        print("{}: {} states, {} edges".format(os.path.basename(edgelist), n_states, n_edges))
+        print("  bitset: {:.3f}s".format(dt))
+
+        if args.legacy:
+            n_states_legacy, _, dt_legacy = replay(transitions, initial, legacy=True)
+            assert n_states_legacy == n_states
+            print("  legacy: {:.3f}s ({:.1f}x)".format(dt_legacy, dt_legacy / dt))
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--legacy', action='store_true',
+                        help='also time the list based frontier')
+    parser.add_argument('edgelists', nargs='*', metavar='FILE',
+                        default=[find_edgelist(os.path.join('results', e)) for e in edgelists],
+                        help='edgelists to replay (default: results/si3x3-*-edgelist.edges, .npy or .txt)')
+
+    args = parser.parse_args()
+    main(args)
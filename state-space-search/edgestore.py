@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Binary storage of state space search edgelists.
+
+Formats, chosen by file extension:
+  .txt    text, one "from to phi" line per edge as written by run_sss before
+  .edges  raw EDGE_DTYPE records without header, so that edges can be
+          appended while the search runs
+  .npy    compressed, one INTERVAL_DTYPE record per run of consecutive edges
+          with the same (from, to), with phi evenly spaced within the run
+"""
+import os
+import glob
+import numpy as np
+
+# Configs are bit patterns of up to 63 magnets
+EDGE_DTYPE = np.dtype([('from', '<u8'), ('to', '<u8'), ('phi', '<f4')])
+INTERVAL_DTYPE = np.dtype([('from', '<u8'), ('to', '<u8'),
+                           ('phi_first', '<f4'), ('phi_last', '<f4'), ('count', '<u4')])
+
+# Edgelist formats, in order of preference when several exist
+EDGELIST_EXTENSIONS = ['.edges', '.npy', '.txt']
+
+def edge_records(src, dst, phi):
+    """ Pack (from, to, phi) sequences into EDGE_DTYPE records """
+    edges = np.empty(len(src), dtype=EDGE_DTYPE)
+    edges['from'] = src
+    edges['to'] = dst
+    edges['phi'] = phi
+    return edges
+
+def read_text(filename):
+    # Parse configs as integers, they need not fit in a double
+    return np.loadtxt(filename, dtype=EDGE_DTYPE, ndmin=1)
+
+def write_text(filename, edges):
+    # phi is single precision, 8 significant digits are enough
+    np.savetxt(filename, edges, fmt='%d %d %.8g', newline='\r\n')
+
+def compress(edges):
+    """ Collapse runs of consecutive edges with the same (from, to) into intervals """
+    change = np.ones(len(edges), dtype=bool)
+    change[1:] = (edges['from'][1:] != edges['from'][:-1]) | (edges['to'][1:] != edges['to'][:-1])
+    starts = np.flatnonzero(change)
+    lasts = np.append(starts[1:], len(edges)) - 1
+
+    intervals = np.empty(len(starts), dtype=INTERVAL_DTYPE)
+    intervals['from'] = edges['from'][starts]
+    intervals['to'] = edges['to'][starts]
+    intervals['phi_first'] = edges['phi'][starts]
+    intervals['phi_last'] = edges['phi'][lasts]
+    intervals['count'] = lasts - starts + 1
+    return intervals
+
+def expand(intervals):
+    """ Inverse of compress, with phi evenly spaced within each interval """
+    counts = intervals['count'].astype(np.int64)
+    starts = np.cumsum(counts) - counts
+    # Position of each edge within its interval
+    k = np.arange(counts.sum()) - np.repeat(starts, counts)
+    steps = (intervals['phi_last'] - intervals['phi_first']) / np.maximum(counts - 1, 1)
+
+    return edge_records(np.repeat(intervals['from'], counts),
+                        np.repeat(intervals['to'], counts),
+                        np.repeat(intervals['phi_first'], counts) + k * np.repeat(steps, counts))
+
+def read_edges(filename):
+    """ Read edgelist in any format as EDGE_DTYPE records """
+    ext = os.path.splitext(filename)[1]
+    if ext == '.txt':
+        return read_text(filename)
+    if ext == '.npy':
+        return expand(np.load(filename))
+    return np.fromfile(filename, dtype=EDGE_DTYPE)
+
+def write_edges(filename, edges):
+    """ Write EDGE_DTYPE records in the format given by the extension of filename """
+    ext = os.path.splitext(filename)[1]
+    if ext == '.txt':
+        write_text(filename, edges)
+    elif ext == '.npy':
+        np.save(filename, compress(edges))
+    else:
+        edges.tofile(filename)
+
+def find_edgelist(base):
+    """ Edgelist base + extension in the preferred format that exists, or base + '.edges' """
+    for ext in EDGELIST_EXTENSIONS:
+        if os.path.exists(base + ext):
+            return base + ext
+    return base + EDGELIST_EXTENSIONS[0]
+
+def glob_edgelists(pattern):
+    """ Edgelists matching pattern (without extension), one per edgelist in the preferred format """
+    bases = set()
+    for ext in EDGELIST_EXTENSIONS:
+        bases.update(f[:-len(ext)] for f in glob.glob(pattern + ext))
+    return [find_edgelist(base) for base in bases]
+
+class EdgeWriter(object):
+    """ Append edges to a .edges file as they are found """
+    def __init__(self, filename, mode='ab'):
+        self.f = open(filename, mode)
+
+    def append(self, src, dst, phi):
+        edge_records(src, dst, phi).tofile(self.f)
+
+    def flush(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def tell(self):
+        return self.f.tell()
+
+    def truncate(self, size):
+        self.f.truncate(size)
+        self.f.seek(size)
+
+    def close(self):
+        self.f.close()
+
+def main(args):
+    edges = read_edges(args.input)
+    write_edges(args.output, edges)
+    print("{}: {} edges, {} -> {} bytes".format(args.output, len(edges),
+        os.path.getsize(args.input), os.path.getsize(args.output)))
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='edgelist to convert (.txt, .edges or .npy)')
+    parser.add_argument('output', help='converted edgelist (.txt, .edges or .npy)')
+
+    args = parser.parse_args()
+    main(args)
@@ -4,32 +4,29 @@ import os
 import numpy as np
 import scipy.signal as signal
 import matplotlib.pyplot as plt
+from edgestore import read_edges, find_edgelist
 
+# In any format, see find_edgelist
 edgelists = [
-        "si3x3-0pst-edgelist.txt",
-        "si3x3-1pst-edgelist.txt",
-        "si3x3-2pst-edgelist.txt",
-        "si3x3-3pst-edgelist.txt",
-        "si3x3-4pst-edgelist.txt",
-        "si3x3-5pst-edgelist.txt",
-        "si3x3-6pst-edgelist.txt",
-        "si3x3-7pst-edgelist.txt",
-        "si3x3-8pst-edgelist.txt",
-        "si3x3-9pst-edgelist.txt",
-        "si3x3-10pst-edgelist.txt",
+        "si3x3-0pst-edgelist",
+        "si3x3-1pst-edgelist",
+        "si3x3-2pst-edgelist",
+        "si3x3-3pst-edgelist",
+        "si3x3-4pst-edgelist",
+        "si3x3-5pst-edgelist",
+        "si3x3-6pst-edgelist",
+        "si3x3-7pst-edgelist",
+        "si3x3-8pst-edgelist",
+        "si3x3-9pst-edgelist",
+        "si3x3-10pst-edgelist",
 ]
 
 
 def read_edgelist(filename):
-    data = np.loadtxt(filename)
-    return data
+    return read_edges(filename)
 
 def unique_states(data):
-    states = set()
-    for state_from, state_to, phi in data:
-        states.add(state_from)
-        states.add(state_to) # needed?
-    return states
+    return np.union1d(data['from'], data['to']) # to needed?
 
 def main(args):
     if args.load:
@@ -39,7 +36,7 @@ def main(args):
     else:
         n_states = []
         for (i, edgelist) in enumerate(edgelists):
-            filename = os.path.join('results', edgelist)
+            filename = find_edgelist(os.path.join('results', edgelist))
             data = read_edgelist(filename)
             states = unique_states(data)
             n_states.append(len(states))
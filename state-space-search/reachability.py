@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Reachability and attractor analysis of state space search edgelists.
+
+Each edgelist is loaded into a graph over the states it contains, numbered
+0..n-1. Strongly connected components, attractors (components that cannot
+be left) and their basins are computed with scipy.sparse.csgraph, and
+reachable sets by breadth-first search over bitsets of all states.
+Summaries are cached next to each edgelist.
+"""
+import os
+import re
+import pickle
+import multiprocessing
+import numpy as np
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components
+from edgestore import read_edges, glob_edgelists
+
+def load_edges(filename):
+    """ Load edgelist (any format, see edgestore.py) as (from, to, phi) arrays """
+    edges = read_edges(filename)
+    return edges['from'].astype(np.int64), edges['to'].astype(np.int64), edges['phi']
+
+class EdgeGraph(object):
+    """ Graph of edges src[k] -> dst[k] at angle phi[k]
+
+    State i of the graph is configuration states[i]. Sets of states are
+    given as bool arrays (bitsets) of length n_states.
+    """
+    def __init__(self, src, dst, phi):
+        self.states, index = np.unique(np.concatenate([src, dst]), return_inverse=True)
+        index = index.ravel()
+        self.src = index[:len(src)]
+        self.dst = index[len(src):]
+        self.phi = np.asarray(phi)
+
+    @classmethod
+    def load(cls, filename):
+        return cls(*load_edges(filename))
+
+    @property
+    def n_states(self):
+        return len(self.states)
+
+    def index(self, config):
+        """ State index of configuration config """
+        i = np.searchsorted(self.states, config)
+        assert i < self.n_states and self.states[i] == config, "Unknown state {}".format(config)
+        return i
+
+    def adjacency(self, phi_range=None):
+        """ Sparse 0/1 adjacency matrix, of edges with phi in phi_range if given """
+        src, dst = self.src, self.dst
+        if phi_range is not None:
+            mask = (self.phi >= phi_range[0]) & (self.phi <= phi_range[1])
+            src, dst = src[mask], dst[mask]
+
+        n = self.n_states
+        pairs = np.unique(src * n + dst)
+        data = np.ones(len(pairs), dtype=np.int32)
+        return scipy.sparse.csr_matrix((data, (pairs // n, pairs % n)), shape=(n, n))
+
+    def components(self, phi_range=None):
+        """ Strongly connected components as (count, component of each state) """
+        return connected_components(self.adjacency(phi_range), directed=True, connection='strong')
+
+    def attractors(self, phi_range=None):
+        """ List of attractors, as arrays of states, sorted by size """
+        A = self.adjacency(phi_range).tocoo()
+        n_components, labels = self.components(phi_range)
+
+        # Attractors are components without edges to other components
+        src, dst = labels[A.row], labels[A.col]
+        has_exit = np.zeros(n_components, dtype=bool)
+        has_exit[src[src != dst]] = True
+
+        members = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[members], np.arange(n_components + 1))
+        attractors = [members[bounds[c]:bounds[c+1]] for c in np.flatnonzero(~has_exit)]
+        return sorted(attractors, key=len, reverse=True)
+
+    def reachable(self, start, phi_range=None, reverse=False):
+        """ Bitset of states reachable from start (index, indices or bitset)
+
+        With reverse, the states from which start can be reached.
+        """
+        A = self.adjacency(phi_range)
+        # Frontier expansion is a product with the transposed adjacency
+        if not reverse:
+            A = A.T.tocsr()
+
+        visited = np.zeros(self.n_states, dtype=bool)
+        visited[start] = True
+        frontier = visited.copy()
+        while frontier.any():
+            frontier = (A.dot(frontier.astype(np.int32)) > 0) & ~visited
+            visited |= frontier
+        return visited
+
+    def basins(self, attractors, phi_range=None):
+        """ Basin of each attractor, as bitsets """
+        return [self.reachable(a, phi_range, reverse=True) for a in attractors]
+
+def summarize(filename, phi_range=None, initial=None):
+    """ Summarize reachability and attractors of edgelist filename """
+    graph = EdgeGraph.load(filename)
+    if initial is None:
+        # The search starts from the first configuration in the edgelist
+        initial = graph.states[graph.src[0]]
+
+    n_components, labels = graph.components(phi_range)
+    attractors = graph.attractors(phi_range)
+    basins = graph.basins(attractors, phi_range)
+    reachable = graph.reachable(graph.index(initial), phi_range)
+
+    return {
+        'n_states': graph.n_states,
+        'n_edges': len(graph.src),
+        'n_components': n_components,
+        'largest_component': int(np.bincount(labels).max()),
+        'attractors': [graph.states[a].tolist() for a in attractors],
+        'basin_sizes': [int(b.sum()) for b in basins],
+        'initial': int(initial),
+        'reachable': graph.states[reachable].tolist(),
+    }
+
+def load_summary(job):
+    """ Summarize edgelist, reusing the cached summary if it is up to date """
+    filename, phi_range, initial, cache = job
+    st = os.stat(filename)
+    key = {
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'phi_range': phi_range,
+        'initial': initial,
+    }
+
+    cachefile = filename + '.reach.pickle'
+    if cache and os.path.exists(cachefile):
+        with open(cachefile, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['key'] == key:
+            return filename, cached['summary']
+
+    summary = summarize(filename, phi_range, initial)
+
+    if cache:
+        tmp = '{}.{}.tmp'.format(cachefile, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump({'key': key, 'summary': summary}, f)
+        os.replace(tmp, cachefile)
+
+    return filename, summary
+
+def summarize_all(filenames, phi_range=None, initial=None, processes=None, cache=True):
+    """ Summarize edgelists in parallel, yielding (filename, summary) in order """
+    jobs = [(f, phi_range, initial, cache) for f in filenames]
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap(load_summary, jobs):
+            yield result
+
+def pst_key(filename):
+    m = re.search(r'(\d+)pst', os.path.basename(filename))
+    return int(m.group(1)) if m else -1
+
+def main(args):
+    filenames = args.edgelists
+    if not filenames:
+        filenames = sorted(glob_edgelists(os.path.join('results', '*pst-edgelist')), key=pst_key)
+
+    phi_range = tuple(args.phi) if args.phi else None
+
+    print("{:<28} {:>7} {:>7} {:>6} {:>8} {:>10} {:>9}".format(
+        "edgelist", "states", "edges", "SCCs", "largest", "attractors", "reachable"))
+    for filename, s in summarize_all(filenames, phi_range, args.initial, args.jobs, not args.no_cache):
+        print("{:<28} {:>7} {:>7} {:>6} {:>8} {:>10} {:>9}".format(
+            os.path.basename(filename), s['n_states'], s['n_edges'], s['n_components'],
+            s['largest_component'], len(s['attractors']), len(s['reachable'])))
+        if args.verbose:
+            for attractor, basin in zip(s['attractors'], s['basin_sizes']):
+                print("  attractor {} (basin {})".format(
+                    " ".join('{:x}'.format(a) for a in attractor), basin))
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of edgelists to analyze in parallel (default: number of CPUs)')
+    parser.add_argument('--phi', nargs=2, type=float, metavar=('MIN', 'MAX'),
+                        help='only use edges with phi in [MIN, MAX]')
+    parser.add_argument('-i', '--initial', type=int, default=None,
+                        help='initial configuration for reachability (default: first in edgelist)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not use or write cached summaries')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='list attractors and basin sizes')
+    parser.add_argument('edgelists', nargs='*', metavar='FILE',
+                        help='edgelists to analyze (default: results/*pst-edgelist.edges, .npy or .txt)')
+
+    args = parser.parse_args()
+    main(args)
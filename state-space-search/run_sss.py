@@ -4,37 +4,103 @@ import os
 import time
 import datetime
 import argparse
+import pickle
 import numpy as np
-from mx3util import gen_job, run_local, run_dist, StoreKeyValue
-
-
-def bit_array(x, n_bits):
-    """ Convert number x to array of bits """
-    return np.array([(x & (1 << bit)) >> bit for bit in range(n_bits)])
-
-def array_bit(a):
-    """ Convert bit array a to number """
-    return sum([(b << bit) for (bit, b) in enumerate(a)])
+from collections import deque
+from mx3util import gen_job, run_dist, StoreKeyValue, parse_table_header, column_indices
+from scheduler import LocalScheduler, slurm_job_active
+from monitor import CompletionMonitor
+from statekeys import encode, decode
+from edgestore import EdgeWriter
 
 
 """
 1. Generate jobs
-2. Wait for their completion
-3. Analyze results
+2. Wait for their completion (event driven, see monitor.py)
+3. Analyze results, queueing jobs for new states
 4. Exit when done
+
+The search state is checkpointed to <template>-checkpoint.pickle in outdir
+at the start and end of the search, and at most every checkpoint_interval
+seconds as jobs start, finish and are analyzed. The edgelist is appended to
+as results come in (as binary records, see edgestore.py). A search that was
+interrupted can be continued with resume=True.
 """
+
+# Interval (seconds) at which Slurm jobs submitted before a resume are polled
+REATTACH_POLL_INTERVAL = 30
+
+# Largest number of magnets whose configurations are tracked in a dense
+# bitset (32 MB), larger configuration spaces use a set
+DENSE_VISITED_BITS = 28
+
+class Visited(object):
+    """ Set of configurations, a packed bitset of all 2^n_bits configurations
+    if that is small enough and a set of the configurations seen otherwise
+    """
+    def __init__(self, n_bits):
+        self.dense = n_bits <= DENSE_VISITED_BITS
+        if self.dense:
+            self.bits = np.zeros(max((1 << n_bits) >> 3, 1), dtype=np.uint8)
+        else:
+            self.configs = set()
+
+    def contains(self, configs):
+        """ Bool array, True for configurations in the set """
+        configs = np.asarray(configs, dtype=np.int64)
+        if self.dense:
+            return ((self.bits[configs >> 3] >> (configs & 7)) & 1).astype(bool)
+        return np.array([c in self.configs for c in configs.tolist()], dtype=bool)
+
+    def add(self, configs):
+        configs = np.atleast_1d(np.asarray(configs, dtype=np.int64))
+        if self.dense:
+            np.bitwise_or.at(self.bits, configs >> 3, (1 << (configs & 7)).astype(np.uint8))
+        else:
+            self.configs.update(configs.tolist())
+
+def magnet_columns(n_bits):
+    """ Table columns of the magnets, the first half are horizontal (x
+    component) and the rest vertical (y component), as in si3x3.mx3
+    """
+    n_horiz = n_bits // 2
+    return ['m.region{}{}'.format(i + 1, 'x' if i < n_horiz else 'y') for i in range(n_bits)]
+
 class StateSpaceSearch(object):
 
-    def __init__(self, template, initial, params, outdir, runtype='local', ngpus=2):
-        self.queue = [initial]
-        self.running = []
+    def __init__(self, template, initial, params, outdir, runtype='local', ngpus=None, n_bits=12,
+                 checkpoint_interval=60):
+        # Configurations are encoded as int64
+        assert n_bits < 64, "At most 63 magnets are supported"
+        self.n_bits = n_bits
+        # All configurations seen so far (queued, running or finished),
+        # which makes discovery of new states O(1)
+        self.visited = Visited(n_bits)
+        self.visited.add(initial)
+
+        self.queue = deque([initial])
+        self.running = set()
         self.finished = []
+        # Configurations whose job failed or timed out, they are not retried
+        self.failed = []
+        # Finished configurations whose results have not been analyzed yet
+        self.unanalyzed = set()
+        # Slurm job ID of running configurations (dist only)
+        self.job_ids = {}
+        # Edges not yet written to the edgelist file, as (config, states, phis)
         self.edgelist = []
-        self.procs = {}
+        self.n_edges = 0
+        self.configs = {}
 
+        if ngpus is None:
+            # One GPU locally unless told otherwise, two per node on the cluster
+            ngpus = 1 if runtype == 'local' else 2
         self.ngpus = ngpus
+        self.monitor = None
+        self.scheduler = None
+        self.scheduler_task = None
         if runtype == 'local':
-            self.ngpus = 1
+            self.scheduler = LocalScheduler(ngpus)
 
         self.template = template
         self.params = params
@@ -43,6 +109,12 @@ class StateSpaceSearch(object):
         root, ext = os.path.splitext(os.path.basename(template))
         self.outfile = root + "_%d" + ext
 
+        self.edgelist_file = os.path.join(outdir, root + "-edgelist.edges")
+        self.edgelist_writer = None
+        self.checkpoint_file = os.path.join(outdir, root + "-checkpoint.pickle")
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = 0
+
         self.runtype = runtype
 
     def get_outfile(self, config):
@@ -53,9 +125,9 @@ class StateSpaceSearch(object):
         filename = os.path.join(self.outdir, filename)
 
         params = dict(self.params) # copy
-        config_array = bit_array(config, 12)
+        config_array = decode(config, self.n_bits)
 
-        for i, bit in enumerate(config_array):
+        for i, bit in enumerate(config_array.tolist()):
             k = "mi{}".format(i+1)
             params[k] = -1 + bit * 2
 
@@ -72,47 +144,156 @@ class StateSpaceSearch(object):
         print("Analyzing job: {}".format(jobdir))
 
         tablefile = os.path.join(jobdir, "table.txt")
-        while not os.path.exists(tablefile):
-            print("Waiting for {}...".format(tablefile))
-            time.sleep(1)
-
-        table = np.loadtxt(tablefile)
-
-        # x components for horizontal nanomagnets
-        horiz = table[:,4:20:3]
+        headers, _ = parse_table_header(tablefile)
+        cols = column_indices(headers, magnet_columns(self.n_bits) + ['phi'])
+        table = np.loadtxt(tablefile, usecols=cols, ndmin=2)
 
-        # y components for vertical nanomagnets
-        vert = table[:,23:40:3]
+        # x components for horizontal nanomagnets, y for vertical ones
+        states = table[:,:-1]
 
         # angles
         phis = table[:,-1]
 
         # Convert state vectors to number
-        states = np.concatenate([horiz, vert], axis=1)
         states = np.round(states)
         states[states < 0] = 0
-        states = states.astype(int)
 
-        states = list(map(array_bit, states))
+        states = encode(states).astype(int)
 
+        self.analyze_states(config, states, phis)
+
+    def analyze_states(self, config, states, phis):
+        """ Queue unseen states and record edges from config """
         print("State {} -> {}".format(config, np.unique(states)))
 
-        for s in states:
-            if s not in self.finished and s not in self.queue and s not in self.running:
-                print("New state: {}".format(s))
-                self.queue.append(s)
+        # Unseen states, in order of first appearance
+        _, first = np.unique(states, return_index=True)
+        new = states[np.sort(first)]
+        new = new[~self.visited.contains(new)]
+        self.visited.add(new)
 
-        # Update edgelist
-        for s, phi in zip(states, phis):
-            self.edgelist.append((config, s, phi))
+        for s in new.tolist():
+            print("New state: {}".format(s))
+            self.queue.append(s)
 
-    def write_edgelist(self, filename):
-        print("Writing edgelist to {}".format(filename))
+        # Update edgelist
+        self.edgelist.append((config, states, phis))
+        self.n_edges += len(states)
+
+    def flush_edgelist(self):
+        """ Append pending edges to the edgelist file """
+        if self.edgelist_writer is None:
+            return
+        for config, states, phis in self.edgelist:
+            self.edgelist_writer.append(np.full(len(states), config), states, phis)
+        self.edgelist = []
 
-        f = open(filename, 'w')
-        for n1, n2, phi in self.edgelist:
-            f.write("{} {} {}\r\n".format(n1, n2, phi))
-        f.close()
+    def checkpoint(self, force=False):
+        """ Atomically save the search state, at most every checkpoint_interval seconds unless forced """
+        now = time.time()
+        if not force and now - self.last_checkpoint < self.checkpoint_interval:
+            return
+
+        # The checkpoint records the edgelist length, so it must be on disk first
+        self.flush_edgelist()
+        self.edgelist_writer.flush()
+
+        state = {
+            'template': self.template,
+            'params': self.params,
+            'n_bits': self.n_bits,
+            'visited': self.visited,
+            'queue': list(self.queue),
+            'running': sorted(self.running),
+            'job_ids': self.job_ids,
+            'finished': self.finished,
+            'failed': self.failed,
+            'unanalyzed': sorted(self.unanalyzed),
+            'n_edges': self.n_edges,
+            'edgelist_size': self.edgelist_writer.tell(),
+        }
+
+        tmp = '{}.{}.tmp'.format(self.checkpoint_file, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_file)
+        self.last_checkpoint = now
+
+    def resume(self):
+        """ Continue the search from the last checkpoint
+
+        Results of jobs that finished since are analyzed from their output
+        directories, Slurm jobs that are still running are waited for, and
+        all other jobs that were running are started again.
+        """
+        with open(self.checkpoint_file, 'rb') as f:
+            state = pickle.load(f)
+        assert state['n_bits'] == self.n_bits, \
+                "Checkpoint is for {} bits, not {}".format(state['n_bits'], self.n_bits)
+
+        self.visited = state['visited']
+        self.queue = deque(state['queue'])
+        self.finished = state['finished']
+        self.failed = state.get('failed', [])
+        self.n_edges = state['n_edges']
+
+        # Drop edges written after the checkpoint, their analysis is redone
+        self.edgelist_writer = EdgeWriter(self.edgelist_file)
+        self.edgelist_writer.truncate(state['edgelist_size'])
+
+        print("Resuming {} queued, {} running, {} finished".format(
+            len(self.queue), len(state['running']), len(self.finished)))
+
+        for config in state['unanalyzed']:
+            self.unanalyzed.add(config)
+            self.watch_table(config)
+
+        # Running jobs by Slurm job, local jobs did not survive
+        jobs = {}
+        requeue = []
+        for config in state['running']:
+            job_id = state['job_ids'].get(config)
+            if job_id is None:
+                requeue.append(config)
+            else:
+                jobs.setdefault(job_id, []).append(config)
+
+        for job_id, configs in sorted(jobs.items()):
+            self.running.update(configs)
+            if slurm_job_active(job_id):
+                print("Reattaching to job {}: {}".format(job_id, configs))
+                self.job_ids.update((c, job_id) for c in configs)
+                self.monitor.watch_until(lambda job_id=job_id: not slurm_job_active(job_id),
+                        lambda _, configs=configs: self.reattached_finished(configs),
+                        REATTACH_POLL_INTERVAL)
+            else:
+                requeue.extend(self.collect(configs))
+
+        if requeue:
+            print("Restarting jobs: {}".format(requeue))
+        self.queue.extendleft(reversed(requeue))
+
+    def collect(self, configs):
+        """ Finish running configs that have results, return the others """
+        missing = []
+        for config in configs:
+            tablefile = os.path.join(self.get_jobdir(config), "table.txt")
+            if os.path.exists(tablefile):
+                self.job_finished(config)
+            else:
+                self.running.remove(config)
+                self.job_ids.pop(config, None)
+                missing.append(config)
+        return missing
+
+    def reattached_finished(self, configs):
+        requeue = self.collect(configs)
+        if requeue:
+            print("Restarting jobs: {}".format(requeue))
+            self.queue.extend(requeue)
+            self.launch()
 
     prev_s = ""
     def print_new(self, s):
@@ -120,60 +301,122 @@ class StateSpaceSearch(object):
             print(s)
             self.prev_s = s
 
-    def poll(self, interval=1):
-        # Look for completed jobs, iterating over a copy of the running list
-        for config in list(self.running):
-            if self.procs[config].poll() is None:
-                # Not finished yet
-                continue
-
-            jobdir = self.get_jobdir(config)
-            self.running.remove(config)
-            self.finished.append(config)
-
-            print("Job finished: {}".format(jobdir))
-
-            self.analyze_job(config, jobdir)
-
-        self.print_new("Poll: {} queued, {} running, {} finished".format(
-            len(self.queue), len(self.running), len(self.finished)))
+    def print_status(self):
+        self.print_new("Status: {} queued, {} running, {} finished, {} failed".format(
+            len(self.queue), len(self.running), len(self.finished), len(self.failed)))
+
+    def job_done(self, config, exit_code):
+        if exit_code == 0:
+            self.job_finished(config)
+        else:
+            self.job_failed(config, exit_code)
+
+    def job_failed(self, config, exit_code):
+        """ Record config as failed, there will be no table to analyze """
+        jobdir = self.get_jobdir(config)
+        self.running.remove(config)
+        self.job_ids.pop(config, None)
+        self.unanalyzed.discard(config)
+        self.failed.append(config)
+        self.checkpoint()
+
+        reason = "timed out" if exit_code is None else "exit code {}".format(exit_code)
+        print("Job failed ({}): {}".format(reason, jobdir))
+        self.print_status()
+
+    def job_finished(self, config):
+        jobdir = self.get_jobdir(config)
+        self.running.remove(config)
+        self.job_ids.pop(config, None)
+        self.finished.append(config)
+        self.unanalyzed.add(config)
+        self.checkpoint()
+
+        print("Job finished: {}".format(jobdir))
+        self.watch_table(config)
+
+    def watch_table(self, config):
+        # The table may appear some time after the job exits on shared
+        # file systems
+        jobdir = self.get_jobdir(config)
+        tablefile = os.path.join(jobdir, "table.txt")
+        self.monitor.watch_file(tablefile, lambda _: self.job_analyzed(config, jobdir))
 
-        time.sleep(interval)
+    def job_analyzed(self, config, jobdir):
+        self.analyze_job(config, jobdir)
+        self.unanalyzed.discard(config)
+        self.flush_edgelist()
+        self.launch()
+        self.checkpoint()
+        self.print_status()
 
     def dequeue(self, n):
-        configs = self.queue[0:n]
-        del self.queue[0:n]
-        return configs
-
-    def run(self):
+        return [self.queue.popleft() for _ in range(min(n, len(self.queue)))]
+
+    def launch(self):
+        """ Start jobs for all queued configurations """
+        launched = bool(self.queue)
+        while self.queue:
+            configs = self.dequeue(self.ngpus)
+            self.running.update(configs)
+
+            jobs = []
+            for config in configs:
+                job = self.gen_job(config)
+                jobs.append(job)
+
+            print("Starting jobs: {}".format(" ".join(jobs)))
+
+            if self.scheduler:
+                self.scheduler.submit(jobs)
+                for config, job in zip(configs, jobs):
+                    self.configs[job] = config
+            else:
+                p = run_dist(jobs, wait=False, parsable=True)
+                # --parsable prints "jobid" or "jobid;cluster"
+                job_id = p.stdout.readline().strip().split(';')[0]
+                if job_id:
+                    self.job_ids.update((c, job_id) for c in configs)
+                self.monitor.watch_process(p, lambda _, p=p, configs=configs:
+                        self.dist_finished(p, configs))
+
+        if self.scheduler and (self.scheduler_task is None or self.scheduler_task.done()):
+            self.scheduler_task = self.monitor.watch_scheduler(self.scheduler,
+                    lambda job, exit_code: self.job_done(self.configs[job], exit_code))
+
+        if launched:
+            self.checkpoint()
+
+    def dist_finished(self, p, configs):
+        # sbatch --wait exits with the exit code of the job
+        p.stdout.close()
+        for config in configs:
+            self.job_done(config, p.returncode)
+
+    def run(self, resume=False):
         t0 = time.time()
         print("Started on {}".format(time.asctime()))
 
-        while self.queue or self.running:
-            while self.queue:
-                configs = self.dequeue(self.ngpus)
-                self.running.extend(configs)
-
-                jobs = []
-                for config in configs:
-                    job = self.gen_job(config)
-                    jobs.append(job)
-
-                print("Starting jobs: {}".format(" ".join(jobs)))
+        self.monitor = CompletionMonitor()
+        if self.scheduler:
+            self.scheduler.start()
 
-                if self.runtype == 'local':
-                    p = run_local(jobs, wait=True, quiet=True)
-                else:
-                    p = run_dist(jobs, wait=False)
+        if resume:
+            self.resume()
+        else:
+            self.edgelist_writer = EdgeWriter(self.edgelist_file, 'wb')
+            self.checkpoint(force=True)
 
-                for config in configs:
-                    self.procs[config] = p
+        self.launch()
+        self.monitor.run()
+        self.monitor.close()
 
-            self.poll()
+        if self.scheduler:
+            self.scheduler.stop()
 
-        base, _ = os.path.splitext(os.path.basename(self.template))
-        filename = os.path.join(self.outdir, base + "-edgelist.txt")
-        self.write_edgelist(filename)
+        self.checkpoint(force=True)
+        self.edgelist_writer.close()
+        filename = self.edgelist_file
 
         t1 = time.time()
         dt = t1 - t0
@@ -182,6 +425,8 @@ class StateSpaceSearch(object):
         print("Completed on {}".format(time.asctime()))
         print("Duration: {}".format(delta))
         print("{} states found".format(len(self.finished)))
+        if self.failed:
+            print("{} jobs failed: {}".format(len(self.failed), self.failed))
         print("See {} for details".format(filename))
 
 
@@ -197,19 +442,27 @@ def main(args):
     if args.param:
         params.update(args.param)
 
-    sss = StateSpaceSearch(args.template, args.initial, params, args.outdir, args.run, args.ngpus)
-    sss.run()
+    sss = StateSpaceSearch(args.template, args.initial, params, args.outdir, args.run, args.ngpus,
+                           args.bits, args.checkpoint_interval)
+    sss.run(args.resume)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run mx3 job')
     parser.add_argument('-r', '--run', choices=['local', 'dist'], default='local',
                         help='run locally or distributed on a cluster')
-    parser.add_argument('-n', '--ngpus', type=int, default=2,
-                        help='number of gpus available on each node')
+    parser.add_argument('-n', '--ngpus', type=int, default=None,
+                        help='number of gpus available on each node, or locally (default: 2 for dist, 1 for local)')
     parser.add_argument('-p', '--param', action=StoreKeyValue,
                         help='set template parameter key=value')
+    parser.add_argument('-b', '--bits', type=int, default=12,
+                        help='number of magnets in a configuration, read from table columns '
+                             'm.region1..N, x for the first half, y for the rest (default: %(default)s)')
     parser.add_argument('-i', '--initial', metavar='N', type=int, default=0xfff,
             help='initial configuration (default: 0x%(default)x)')
+    parser.add_argument('--resume', action='store_true',
+            help='continue an interrupted search from its checkpoint in outdir')
+    parser.add_argument('--checkpoint-interval', metavar='SECONDS', type=float, default=60,
+            help='minimum time between checkpoints while the search runs (default: %(default)s)')
     parser.add_argument('template', help='job template')
     parser.add_argument('outdir', help='output directory for job files')
 
@@ -3,6 +3,7 @@
 import os
 import pickle
 import numpy as np
+import scipy.sparse
 import matplotlib.pyplot as plt
 import networkx as nx
 import subprocess
@@ -10,15 +11,129 @@ from itertools import groupby, cycle
 from operator import itemgetter
 from networkx.drawing.nx_agraph import write_dot
 from mx3util import *
+from statekeys import encode, hex_labels
+from statestream import load_states
 
 def state_label(s):
     # return ('0x{:0' + str(len(s)) + 'x}').format(array_bit(s))
     return '{:x}'.format(array_bit(s))
     # return hex(array_bit(s))
 
+def state_labels(X):
+    """ Labels of all states (rows) in X, as state_label """
+    return hex_labels(encode(X)).tolist()
+
 def group_consecutive(l):
     return [list(map(itemgetter(1), g)) for k, g in groupby(enumerate(l), (lambda i: i[0]-i[1]))]
 
+class TransitionGraph(object):
+    """ State transition graph of one or more digitized runs
+
+    States are numbered in order of their keys. counts is a sparse
+    (n_states, n_states) CSR matrix of transition counts, visit_counts the
+    number of time steps spent in each state, and the visits of state i are
+    the (first, last) time step ranges visit_ranges[visit_ptr[i]:visit_ptr[i+1]].
+    """
+    def __init__(self, keys, counts, visit_counts, visit_ranges, visit_ptr, edge_labels=None):
+        self.keys = keys
+        self.counts = counts
+        self.visit_counts = visit_counts
+        self.visit_ranges = visit_ranges
+        self.visit_ptr = visit_ptr
+        self.edge_labels = edge_labels
+
+    @property
+    def n_states(self):
+        return len(self.keys)
+
+    @property
+    def n_transitions(self):
+        return self.counts.nnz
+
+    @property
+    def labels(self):
+        return hex_labels(self.keys).tolist()
+
+    def visits(self, i):
+        """ Visits of state i as list of (first, last) time steps """
+        a, b = self.visit_ptr[i], self.visit_ptr[i+1]
+        return [tuple(r) for r in self.visit_ranges[a:b].tolist()]
+
+    def to_networkx(self):
+        """ Build a NetworkX DiGraph with count and visits attributes """
+        labels = self.labels
+        G = nx.DiGraph()
+        for i, u in enumerate(labels):
+            G.add_node(u, count=int(self.visit_counts[i]), visits=self.visits(i))
+
+        counts = self.counts.tocoo()
+        for u, v, c in zip(counts.row.tolist(), counts.col.tolist(), counts.data.tolist()):
+            attr = {'count': c}
+            if self.edge_labels is not None:
+                attr['label'] = self.edge_labels[(u, v)]
+            G.add_edge(labels[u], labels[v], **attr)
+
+        return G
+
+def transition_graph(runs, inputs=None):
+    """ Build TransitionGraph from a list of digitized (T, n) runs
+
+    If given, inputs[r][t] labels the transition from time step t of run r.
+    Like add_edge, the last label of repeated transitions is kept, and only
+    transitions that have an input are included.
+    """
+    keys = [encode(X) for X in runs]
+    lengths = np.array([len(k) for k in keys])
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    # State index of each time step of all runs
+    uniq, index = np.unique(np.concatenate(keys), axis=0, return_inverse=True)
+    index = index.ravel()
+    n = len(uniq)
+
+    # Transitions
+    src = []
+    dst = []
+    labels = []
+    for r, (a, b) in enumerate(zip(offsets[:-1], offsets[1:])):
+        m = max(b - a - 1, 0)
+        if inputs is not None:
+            m = min(m, len(inputs[r]))
+            labels.extend(list(inputs[r])[:m])
+        src.append(index[a:a+m])
+        dst.append(index[a+1:a+1+m])
+    src = np.concatenate(src).astype(np.int64)
+    dst = np.concatenate(dst).astype(np.int64)
+
+    pairs, pair_index, pair_counts = np.unique(src * n + dst, return_inverse=True, return_counts=True)
+    counts = scipy.sparse.csr_matrix((pair_counts, (pairs // n, pairs % n)), shape=(n, n))
+
+    edge_labels = None
+    if inputs is not None:
+        last = np.zeros(len(pairs), dtype=np.int64)
+        np.maximum.at(last, pair_index.ravel(), np.arange(len(src)))
+        edge_labels = {(u, v): labels[k] for u, v, k in
+                zip((pairs // n).tolist(), (pairs % n).tolist(), last.tolist())}
+
+    # Visits as runs of equal state within each run
+    change = np.ones(len(index), dtype=bool)
+    change[1:] = index[1:] != index[:-1]
+    change[offsets[:-1][lengths > 0]] = True
+    starts = np.flatnonzero(change)
+    lasts = np.append(starts[1:], len(index)) - 1
+    # Split ranges that cross run boundaries
+    run_of = np.searchsorted(offsets, starts, side='right') - 1
+    lasts = np.minimum(lasts, offsets[run_of + 1] - 1)
+    t0 = offsets[run_of]
+
+    states = index[starts]
+    order = np.argsort(states, kind='stable')
+    visit_ranges = np.stack([starts - t0, lasts - t0], axis=1)[order]
+    visit_ptr = np.searchsorted(states[order], np.arange(n + 1))
+    visit_counts = np.bincount(index, minlength=n)
+
+    return TransitionGraph(uniq, counts, visit_counts, visit_ranges, visit_ptr, edge_labels)
+
 def load_graph(filename, var, spp, skip, run_index=0, input_param=None):
     print("Loading {}...".format(filename))
     run = RunInfo(filename, load=True)
@@ -32,44 +147,27 @@ def load_graph(filename, var, spp, skip, run_index=0, input_param=None):
 
     print("Variables: {}".format(", ".join(variables)))
 
-    G = nx.DiGraph()
-    # G = nx.MultiDiGraph()
-
+    runs = []
+    inputs = [] if input_param else None
     for i in range(repeat_count):
-        X = run.load_table(run_index, i, variables)
-        X = poincare(X, spp, skip)
-        X = digitize(X)
-
-        states = list(map(state_label, X))
-        attrs = [{}]*(len(states)-1)
+        tablefile = run.get_table_filename(run_index, i)
+        runs.append(load_states(tablefile, variables, spp, skip))
         if input_param:
-            input = run.run_info[run_index][i]['params'][input_param]
-            attrs = [{'label': i} for i in input]
-            # attrs = [{'label': input[:i+1]} for i in range(len(input))]
-            # attrs = [{'label': input} for i in input]
-            print(attrs)
+            inputs.append(run.get_params(run_index, i)[input_param])
 
-        for u, v, attr in zip(states[:-1], states[1:], attrs):
-            # print("{}->{} {}".format(u, v, attr))
-            G.add_edge(u, v, **attr)
+    graph = transition_graph(runs, inputs)
 
-        for t, u in enumerate(states):
-            c = G.nodes[u].setdefault('count', 0)
-            G.nodes[u]['count'] += 1
-            G.nodes[u].setdefault('t', [])
-            G.nodes[u]['t'].append(t)
+    print("Graph: {} nodes, {} edges".format(graph.n_states, graph.n_transitions))
 
-    print("Graph: {} nodes, {} edges".format(G.number_of_nodes(), G.number_of_edges()))
-
-    return G
+    return graph
 
 def label_nodes(G, labels=True, label_time=False):
     # Add labels
     for u in G.nodes:
         # G.nodes[u]['label'] = '{} ({})'.format(u, G.nodes[u]['count'])
         if label_time:
-            t = group_consecutive(G.nodes[u]['t'])
-            tl = ['{}-{}'.format(ti[0], ti[-1]) if len(ti) > 1 else '{}'.format(ti[0]) for ti in t]
+            t = G.nodes[u]['visits']
+            tl = ['{}-{}'.format(a, b) if b > a else '{}'.format(a) for a, b in t]
             tl = ', '.join(tl)
 
             G.nodes[u]['label'] = '{} (t={})'.format(u, tl)
@@ -108,9 +206,16 @@ def show_graph(G):
     plt.show()
 
 def main(args):
-    G = load_graph(args.filename, args.variables, args.spp, args.skip,
+    graph = load_graph(args.filename, args.variables, args.spp, args.skip,
             args.run, args.input_param)
 
+    if args.matrix:
+        scipy.sparse.save_npz(args.matrix, graph.counts)
+        np.save(os.path.splitext(args.matrix)[0] + '-keys.npy', graph.keys)
+        if not (args.dot or args.savefig):
+            return
+
+    G = graph.to_networkx()
     label_nodes(G, args.labels, args.label_time)
 
     if args.colors:
@@ -143,6 +248,8 @@ if __name__ == '__main__':
     parser.add_argument('--colors', action='store_true', help='Color nodes')
     parser.add_argument('-o', '--savefig', help='Save figure(s) to file')
     parser.add_argument('-d', '--dot', help='Save Graphviz dotfile')
+    parser.add_argument('-m', '--matrix', metavar='FILE',
+            help='Save sparse transition count matrix (.npz) and state keys (-keys.npy)')
 
     args = parser.parse_args()
 
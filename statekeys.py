@@ -0,0 +1,134 @@
+"""
+Vectorized encoding of digitized magnet states as integer keys
+
+A state is a 0/1 vector with one element per magnet, element 0 being the
+least significant bit as in array_bit. States of up to 64 magnets are
+encoded as one uint64 key, larger states as rows of WORD_BITS bit words,
+least significant word first.
+"""
+import numpy as np
+
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+
+HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+
+def word_count(n_bits):
+    return max(1, (n_bits + WORD_BITS - 1) // WORD_BITS)
+
+def pack(X):
+    """ Pack (T, n) 0/1 array into (T, ceil(n/8)) bytes, least significant bit first """
+    X = np.asarray(X)
+    return np.packbits(X != 0, axis=-1, bitorder='little')
+
+def unpack(packed, n_bits):
+    """ Inverse of pack, returns (T, n_bits) uint8 0/1 array """
+    return np.unpackbits(packed, axis=-1, count=n_bits, bitorder='little')
+
+def packed_keys(packed):
+    """ Keys (as encode) of states packed with pack """
+    packed = np.atleast_2d(packed)
+    T, n_bytes = packed.shape
+    n_words = max(1, (n_bytes + 7) // 8)
+    padded = np.zeros((T, n_words * 8), dtype=np.uint8)
+    padded[:,:n_bytes] = packed
+    keys = padded.view('<u8').astype(np.uint64)
+    if n_words == 1:
+        keys = keys[:,0]
+    return keys
+
+def byte_keys(X):
+    """ Encode (T, n) 0/1 array as T opaque fixed size byte keys
+
+    Byte keys hash and sort (np.unique) as a whole, but do not sort in
+    numerical order.
+    """
+    packed = np.ascontiguousarray(pack(np.atleast_2d(X)))
+    return packed.view('V{}'.format(packed.shape[1]))[:,0]
+
+def as_words(keys, n_words=1):
+    """ View keys from encode as (T, n_words) uint64 """
+    keys = np.asarray(keys, dtype=np.uint64)
+    if keys.ndim < 2:
+        keys = keys.reshape(-1, n_words)
+    return keys
+
+def encode(X):
+    """ Encode (T, n) 0/1 array X as keys
+
+    Returns (T,) uint64 for n <= 64, (T, n_words) uint64 otherwise. A single
+    state (1D X) gives a single key.
+    """
+    X = np.asarray(X)
+    single = X.ndim == 1
+    X = np.atleast_2d(X)
+    T, n = X.shape
+    n_words = word_count(n)
+
+    # Pad to whole words, so that the packed bytes can be viewed as words
+    bits = np.zeros((T, n_words * WORD_BITS), dtype=bool)
+    bits[:,:n] = X != 0
+    packed = np.packbits(bits, axis=1, bitorder='little')
+    keys = packed.view('<u8').astype(np.uint64)
+
+    if n_words == 1:
+        keys = keys[:,0]
+    return keys[0] if single else keys
+
+def decode(keys, n_bits):
+    """ Decode keys (or a single int) into (T, n_bits) 0/1 array, inverse of encode """
+    single = np.ndim(keys) == 0 or (n_bits > WORD_BITS and np.ndim(keys) == 1)
+    if isinstance(keys, int) and n_bits > WORD_BITS:
+        keys = from_int(keys, n_bits)
+    words = as_words(keys, word_count(n_bits))
+
+    packed = np.ascontiguousarray(words.astype('<u8')).view(np.uint8)
+    X = np.unpackbits(packed, axis=1, count=n_bits, bitorder='little')
+    return X[0] if single else X
+
+def from_int(x, n_bits):
+    """ Split Python int x into the words of a multiword key """
+    return np.array([(x >> (WORD_BITS * i)) & WORD_MASK for i in range(word_count(n_bits))],
+            dtype=np.uint64)
+
+def to_int(keys):
+    """ Convert keys of (T, n) states to a list of Python ints, or a single uint64 key to an int """
+    if np.ndim(keys) == 0:
+        return int(keys)
+    words = as_words(keys)
+    if words.shape[1] == 1:
+        return words[:,0].tolist()
+    # Combine words, most significant first
+    values = [0] * len(words)
+    for w in range(words.shape[1] - 1, -1, -1):
+        values = [(v << WORD_BITS) | x for v, x in zip(values, words[:,w].tolist())]
+    return values
+
+def popcount(keys):
+    """ Number of set bits of each key word, for keys of any shape """
+    keys = np.asarray(keys, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(keys).astype(np.int64)
+    b = np.ascontiguousarray(keys.astype('<u8')).view(np.uint8)
+    bits = np.unpackbits(b.reshape(keys.shape + (8,)), axis=-1)
+    return bits.sum(axis=-1, dtype=np.int64)
+
+def hex_labels(keys):
+    """ Hexadecimal labels of keys, as '{:x}'.format(array_bit(s))
+
+    Returns an array of str.
+    """
+    words = as_words(keys)
+    T, n_words = words.shape
+
+    # Big endian bytes, most significant word first
+    b = np.ascontiguousarray(words[:,::-1].astype('>u8')).view(np.uint8)
+    nibbles = np.empty((T, 2 * b.shape[1]), dtype=np.uint8)
+    nibbles[:,0::2] = b >> 4
+    nibbles[:,1::2] = b & 0xf
+
+    chars = np.ascontiguousarray(HEX_DIGITS[nibbles])
+    labels = chars.view('S{}'.format(chars.shape[1]))[:,0]
+    labels = np.char.lstrip(labels, b'0')
+    labels[labels == b''] = b'0'
+    return labels.astype(str)
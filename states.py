@@ -4,48 +4,71 @@ import os
 import pickle
 import numpy as np
 import matplotlib.pyplot as plt
-from itertools import cycle, groupby
+from itertools import cycle
 from mx3util import *
+from statestream import load_states, load_state_keys
+from statekeys import popcount
 
 def load_data(tablefile, variables, spp=100, skip=1):
-    X = load_table(tablefile, variables)
-    return digitize(X, spp, skip)
+    return load_states(tablefile, variables, spp, skip)
 
 def unique_states(X):
     # Concatenate runs
     return np.unique(np.concatenate(X), axis=0)
 
-def count_states(X):
-    return len(unique_states(X))
-
-def final_states(X):
-    return X[None, :, -1] # retain shape
-
-def count_final_states(X):
-    X = final_states(X)
-    return count_states(X)
-
-def count_diff(X):
-    # Treat runs separately
-    diff = np.count_nonzero(X[:,:-1] != X[:,1:], axis=2)
-    return np.sum(diff, axis=1)
-
-def count_final_len(X):
-    final_lens = []
-    for Xi in X:
-        # Going backwards, find the first group of equal elements
-        groups = groupby(map(tuple, Xi[::-1]))
-        first = next(groups)
-        final_len = len(list(first[1]))
-        final_lens.append(final_len)
-        '''
-        eqfinal = np.all(Xi == Xi[-1], axis=1)
-        print(eqfinal)
-        # Going backwards, find index first state not equal to final state
-        final_len = np.where(eqfinal[::-1] == False)[0][0]
-        final_lens.append(final_len)
-        '''
-    return np.mean(final_lens)
+#
+# Statistics of a run, given the state keys of all its repeats as a
+# (repeats, samples) array, or (repeats, samples, words) for more than 64
+# magnets (see statekeys)
+#
+def key_rows(K):
+    """ Keys as (n, words) rows """
+    return K.reshape(-1, 1) if K.ndim == 2 else K.reshape(-1, K.shape[-1])
+
+def count_states(K):
+    return len(np.unique(key_rows(K), axis=0))
+
+def count_final_states(K):
+    return count_states(K[:, -1:])
+
+def state_diffs(K):
+    # Number of magnets flipped over each run
+    flips = popcount(K[:, 1:] ^ K[:, :-1])
+    if K.ndim == 3:
+        flips = flips.sum(axis=2)
+    return flips.sum(axis=1)
+
+def count_diff(K):
+    # Treat runs separately, average number of magnets flipped per run
+    return np.mean(state_diffs(K))
+
+def final_lens(K):
+    # Number of samples at the end of each run equal to the final state
+    eq = K == K[:, -1:]
+    if K.ndim == 3:
+        eq = eq.all(axis=2)
+    n_samples = eq.shape[1]
+    # First sample, going backwards, that differs from the final state
+    differs = ~eq[:, ::-1]
+    return np.where(differs.any(axis=1), differs.argmax(axis=1), n_samples)
+
+def count_final_len(K):
+    return np.mean(final_lens(K))
+
+def repeat_stats(K):
+    """ Statistics of a single repeat, given its keys as (samples,) or (samples, words)
+
+    Returns the distinct states and the final state as key rows, from which
+    state_count and final_count follow for any set of repeats, and the
+    values that count_diff and count_final_len average over repeats.
+    """
+    K = K[np.newaxis]
+    return {
+        'states': np.unique(key_rows(K), axis=0),
+        'final_state': key_rows(K[:, -1:]),
+        'state_diff': int(state_diffs(K)[0]),
+        'final_len': int(final_lens(K)[0]),
+    }
 
 stats_available = {
     'state_count': count_states,
@@ -54,7 +77,12 @@ stats_available = {
     'final_len': count_final_len,
 }
 
-def load_stats(filename, var, stat, spp, skip):
+def load_stats_table(filename, var, stats, spp, skip, processes=None):
+    """ Evaluate statistics for every sweep point, loading each table once
+
+    Returns sweep parameter, sweep values and a (sweep points, statistics)
+    table, which is NaN for incomplete runs.
+    """
     print("Loading {}...".format(filename))
     run = RunInfo(filename, load=True)
     sweep_spec = run['sweep_spec']
@@ -63,7 +91,7 @@ def load_stats(filename, var, stat, spp, skip):
     sweep_param = sweep_spec[0][0]
     sweep_values = [sp[1] for sp in sweep_spec]
     assert len(sweep_values) == run.run_count, "Not enough runs"
-    stat_fn = stats_available[stat]
+    stat_fns = [stats_available[stat] for stat in stats]
 
     print("#Parameter values: {}".format(len(sweep_values)))
     print("#Runs per value: {}".format(run.repeat_counts()))
@@ -71,7 +99,7 @@ def load_stats(filename, var, stat, spp, skip):
     print("Parameter range: {}..{} [{}]".format(
         np.min(sweep_values), np.max(sweep_values),
         sweep_values[1] - sweep_values[0]))
-    print("Statistic: {}".format(stat))
+    print("Statistics: {}".format(", ".join(stats)))
 
     # Learn available variables from first run
     header = run.get_header(0, 0)
@@ -79,30 +107,25 @@ def load_stats(filename, var, stat, spp, skip):
 
     print("Variables: {}".format(", ".join(variables)))
 
-    n_vars = len(variables)
-
-    stats = np.zeros(len(sweep_values), dtype=int)
-    state_count = np.zeros(len(sweep_values), dtype=int)
+    table = np.full((len(sweep_values), len(stats)), np.nan)
 
-    for run_index in range(run.run_count):
-        X = []
-        try:
-            for repeat_index in range(run.repeat_count(run_index)):
-                Xi = run.load_table(run_index, repeat_index, variables)
-                Xi = poincare(Xi, spp, skip)
-                Xi = digitize(Xi)
-                X.append(Xi)
-        except FileNotFoundError:
+    runs = run.iter_runs(variables, spp, skip, processes=processes, loader=load_state_keys)
+    for run_index, K in runs:
+        if K is None:
             print("incomplete", end=' ', flush=True)
             continue
 
-        X = np.array(X)
-        stats[run_index] = stat_fn(X)
-        print(stats[run_index], end=' ', flush=True)
+        table[run_index] = [fn(K) for fn in stat_fns]
+        print("/".join("{:g}".format(v) for v in table[run_index]), end=' ', flush=True)
 
     print("\n")
 
-    return sweep_param, sweep_values, stats
+    return sweep_param, sweep_values, table
+
+def load_stats(filename, var, stat, spp, skip, processes=None):
+    """ Evaluate a single statistic, see load_stats_table """
+    sweep_param, sweep_values, table = load_stats_table(filename, var, [stat], spp, skip, processes)
+    return sweep_param, sweep_values, table[:, 0]
 
 def main(args):
     labels = args.label if args.label else args.filename
@@ -112,11 +135,19 @@ def main(args):
     sweep_values = []
     stats = []
     for filename in args.filename:
-        sp, sv, st = load_stats(filename, args.variables, args.stat, args.spp, args.skip)
+        sp, sv, st = load_stats_table(filename, args.variables, args.stat, args.spp, args.skip, args.jobs)
         sweep_params.append(sp)
         sweep_values.append(sv)
         stats.append(st)
 
+        if args.dump:
+            base, ext = os.path.splitext(args.dump)
+            dump = args.dump if len(args.filename) == 1 else \
+                    '{}-{}{}'.format(base, len(stats) - 1, ext)
+            print("Saving statistics to {}".format(dump))
+            np.savetxt(dump, np.column_stack([sv, st]),
+                    header=", ".join([sp] + args.stat))
+
     assert len(set(sweep_params)) == 1, "Different sweep params?"
 
     if args.combine:
@@ -126,21 +157,26 @@ def main(args):
 
     assert len(labels) >= len(stats), "Need more labels!"
 
+    fig, axes = plt.subplots(len(args.stat), 1, sharex=True, squeeze=False)
+    axes = axes[:, 0]
+
     for sp, sv, st, lb in zip(sweep_params, sweep_values, stats, labels):
-        # plt.plot(sweep_values, stats, 'o-')
-        # plt.semilogy(sweep_values, stats, 'o-', basey=2)
-        plt.plot(sv, st, 'o-', label=lb)
-        # plt.plot(2**np.array(sweep_values), stats, 'o-')
-        # plt.plot(sv, 2**np.array(sv))
+        for ax, y in zip(axes, st.T):
+            # plt.plot(sweep_values, stats, 'o-')
+            # plt.semilogy(sweep_values, stats, 'o-', basey=2)
+            ax.plot(sv, y, 'o-', label=lb)
+            # plt.plot(2**np.array(sweep_values), stats, 'o-')
+            # plt.plot(sv, 2**np.array(sv))
 
     if title:
-        plt.title(title)
+        axes[0].set_title(title)
 
-    plt.xlabel(sweep_params[0])
-    plt.ylabel(args.stat)
+    axes[-1].set_xlabel(sweep_params[0])
+    for ax, stat in zip(axes, args.stat):
+        ax.set_ylabel(stat)
 
     if len(stats) > 1:
-        plt.legend()
+        axes[0].legend()
 
     if args.savefig:
         print("Saving figure {}".format(args.savefig))
@@ -155,14 +191,18 @@ if __name__ == '__main__':
     parser.add_argument('-f', '--filename', nargs='+', help='run_info file(s)')
     parser.add_argument('-v', '--variables', nargs='+',
             help='list of variables to plot')
-    parser.add_argument('-t', '--stat', choices=stats_available.keys(),
-            default='state_count')
+    parser.add_argument('-t', '--stat', nargs='+', choices=stats_available.keys(),
+            default=['state_count'], help='statistic(s) to compute, from one pass over the tables')
+    parser.add_argument('--dump', metavar='FILE',
+            help='Save statistics table (one row per sweep point) to text file')
     parser.add_argument('-c', '--combine', action='store_true', default=False,
             help='Combine input files to single plot')
     parser.add_argument('-s', '--spp', type=int, default=100,
             help='Samples per period')
     parser.add_argument('-k', '--skip', type=float, default=0,
             help='Periods to skip')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='Number of processes used to load tables (default: all cores)')
     parser.add_argument('-o', '--savefig',
             help='Save figure(s) to file')
     parser.add_argument('-l', '--label', nargs='+')
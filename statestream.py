@@ -0,0 +1,106 @@
+"""
+Bit-packed streams of digitized magnet states
+
+A state stream holds one packed row (see statekeys.pack) per Poincare
+sample of a table. It is produced once from the table and stored next to
+it as <table>.states-<id>.npy and .meta, where id identifies the columns,
+sampling and threshold. Streams are rebuilt when the table changes.
+"""
+import os
+import pickle
+import numpy as np
+from mx3util import content_hash, load_poincare, iter_table_chunks
+import statekeys
+
+def stream_id(columns, step, skip, threshold):
+    return content_hash(repr((list(columns or []), int(step), float(skip), threshold)))[:10]
+
+def get_state_stream(tablefile, columns=None, step=1, skip=0, threshold=0):
+    """ Filenames of the state stream sidecar (data, meta) for a table file """
+    base = '{}.states-{}'.format(tablefile, stream_id(columns, step, skip, threshold))
+    return base + '.npy', base + '.meta'
+
+def open_state_stream(tablefile, columns=None, step=1, skip=0, threshold=0):
+    """ Open a state stream as (packed, meta), or return None if it is missing or stale """
+    data_file, meta_file = get_state_stream(tablefile, columns, step, skip, threshold)
+    try:
+        st = os.stat(tablefile)
+        with open(meta_file, 'rb') as f:
+            meta = pickle.load(f)
+        if meta['size'] == st.st_size and meta['mtime'] == st.st_mtime_ns:
+            return np.load(data_file, mmap_mode='r'), meta
+    except (OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError):
+        pass
+
+    return None
+
+def build_state_stream(tablefile, columns=None, step=1, skip=0, threshold=0):
+    """ Digitize and pack the Poincare samples of a table """
+    step = int(step)
+    if step > 1:
+        # Few rows, only these are parsed
+        X = load_poincare(tablefile, columns, step, skip)
+        return statekeys.pack(X > threshold), X.shape[1]
+
+    # Every row, digitize in chunks to bound memory use
+    start = int(skip * step)
+    chunks = []
+    n_bits = 0
+    offset = 0
+    for X in iter_table_chunks(tablefile, columns):
+        chunks.append(statekeys.pack(X[max(start - offset, 0):] > threshold))
+        n_bits = X.shape[1]
+        offset += len(X)
+    if not chunks:
+        return np.zeros((0, 0), dtype=np.uint8), 0
+    return np.concatenate(chunks), n_bits
+
+def load_state_stream(tablefile, columns=None, step=1, skip=0, threshold=0):
+    """ Load the state stream of a table as (packed, n_bits), building it if needed """
+    cached = open_state_stream(tablefile, columns, step, skip, threshold)
+    if cached is not None:
+        packed, meta = cached
+        return packed, meta['n_bits']
+
+    packed, n_bits = build_state_stream(tablefile, columns, step, skip, threshold)
+    if not os.path.exists(tablefile):
+        # Packed sweep, there is nothing to check the stream against
+        return packed, n_bits
+
+    st = os.stat(tablefile)
+    meta = {
+        'size': st.st_size,
+        'mtime': st.st_mtime_ns,
+        'columns': columns,
+        'step': step,
+        'skip': skip,
+        'threshold': threshold,
+        'n_bits': n_bits,
+        'shape': packed.shape,
+    }
+
+    data_file, meta_file = get_state_stream(tablefile, columns, step, skip, threshold)
+    try:
+        tmp = '{}.{}.tmp'.format(data_file, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, packed)
+        os.replace(tmp, data_file)
+        tmp = '{}.{}.tmp'.format(meta_file, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(meta, f)
+        os.replace(tmp, meta_file)
+    except OSError:
+        # Read-only data directory
+        pass
+
+    return packed, n_bits
+
+def load_states(tablefile, columns=None, step=1, skip=0, threshold=0):
+    """ Digitized Poincare samples of a table as (T, n) 0/1 array, as digitize(load_poincare(...)) """
+    packed, n_bits = load_state_stream(tablefile, columns, step, skip, threshold)
+    return statekeys.unpack(packed, n_bits)
+
+def load_state_keys(tablefile, columns=None, step=1, skip=0, threshold=0):
+    """ Digitized Poincare samples of a table as state keys, see statekeys.encode """
+    packed, n_bits = load_state_stream(tablefile, columns, step, skip, threshold)
+    return statekeys.packed_keys(packed)
@@ -0,0 +1,22 @@
+#!/bin/bash
+#SBATCH --job-name=mumax3
+#SBATCH --partition=EPIC
+#SBATCH --time=24:00:00
+#SBATCH --gres=gpu:{{jobs_per_task}}
+#SBATCH --array={{array}}
+#SBATCH --output={{job_script_dir}}/{{job_script_name}}.slurm-%A_%a.out
+
+# Each array task runs the jobs on line SLURM_ARRAY_TASK_ID of the job list
+
+set -e
+
+module purge
+module load CUDA
+module load Go
+export GOPATH=$HOME
+
+jobs=$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" {{job_list}})
+
+set -x
+
+mumax3 $jobs
@@ -0,0 +1,42 @@
+import os
+import sys
+import pytest
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'state-space-search'))
+
+from manifest import Manifest, MANIFEST_FILENAME
+
+def write_table(filename, X):
+    os.makedirs(os.path.dirname(filename))
+    with open(filename, 'w') as f:
+        f.write("# t (s)\tmx ()\tmy ()\tmz ()\n")
+        np.savetxt(f, X, delimiter='\t')
+
+@pytest.fixture
+def manifest_sweep(tmp_path):
+    """ Factory of a sweep in tmp_path with a manifest and one table per job
+
+    Column k + 1 of the table of repeat j of run i is 10 * i + j + k.
+    Returns the manifest filename.
+    """
+    def make(runs=3, repeats=2, rows=5, status=None):
+        outdir = str(tmp_path)
+        filename = os.path.join(outdir, MANIFEST_FILENAME)
+        manifest = Manifest(filename)
+        manifest.set_info({'type': 'sweep'})
+        jobs = []
+        for i in range(runs):
+            for j in range(repeats):
+                X = np.column_stack([np.arange(rows) * 1e-10] +
+                                    [np.full(rows, 10 * i + j + k) for k in range(3)])
+                write_table(os.path.join(outdir, 't.{:06d}.{:06d}.out'.format(i, j), 'table.txt'), X)
+                jobs.append((i, j, 't.{:06d}.{:06d}.mx3'.format(i, j), {'B': 0.1 * i, 'repeat_index': j}, None))
+        manifest.add_jobs(jobs)
+        if status:
+            manifest.set_status([(i, j) for i, j, _, _, _ in jobs], status)
+        manifest.close()
+        return filename
+    return make
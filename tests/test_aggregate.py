@@ -0,0 +1,30 @@
+import argparse
+import threading
+from manifest import Manifest
+from mx3util import RunInfo
+import aggregate
+
+def watch_args(filename):
+    return argparse.Namespace(filename=filename, output=None, variables=None, spp=1, skip=0,
+                              compression='bz2', jobs=2, settle=60, watch=0.1, dump=None)
+
+def run_main(args, timeout=30):
+    """ Run aggregate.main, return whether it returned within timeout seconds """
+    t = threading.Thread(target=aggregate.main, args=(args,))
+    t.daemon = True
+    t.start()
+    t.join(timeout)
+    return not t.is_alive()
+
+def test_watch_exits_with_failed_jobs(manifest_sweep):
+    filename = manifest_sweep(runs=3, repeats=2, rows=20, status='finished')
+    manifest = Manifest(filename)
+    manifest.set_status([(2, 1)], 'failed', exit_code=1)
+    manifest.close()
+
+    assert run_main(watch_args(filename))
+
+    agg = aggregate.Aggregator(RunInfo(filename, load=True), spp=1)
+    assert len(agg.processed()) == 5
+    assert agg.failed() == {(2, 1)}
+    agg.close()
@@ -0,0 +1,55 @@
+import numpy as np
+from complexity import lz76, longest_previous_factor, suffix_array
+
+def kaspar_schuster(s):
+    """ Reference LZ76 complexity, the original Kaspar-Schuster algorithm """
+    s = list(s)
+    n = len(s)
+    if n < 2:
+        return n
+    c, l, i, k, k_max = 1, 1, 0, 1, 1
+    while True:
+        if s[i + k - 1] == s[l + k - 1]:
+            k += 1
+            if l + k > n:
+                return c + 1
+        else:
+            k_max = max(k, k_max)
+            i += 1
+            if i == l:
+                c += 1
+                l += k_max
+                if l + 1 > n:
+                    return c
+                i, k, k_max = 0, 1, 1
+            else:
+                k = 1
+
+def naive_lpf(s):
+    s = list(s)
+    lpf = []
+    for i in range(len(s)):
+        best = 0
+        for j in range(i):
+            h = 0
+            while i + h < len(s) and s[j + h] == s[i + h]:
+                h += 1
+            best = max(best, h)
+        lpf.append(best)
+    return lpf
+
+def test_suffix_array():
+    s = np.array([1, 0, 1, 0, 1, 2, 0])
+    expected = sorted(range(len(s)), key=lambda i: list(s[i:]))
+    assert list(suffix_array(s)) == expected
+
+def test_lz76_random():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        s = rng.integers(0, rng.integers(1, 5), rng.integers(0, 60))
+        assert lz76(s) == kaspar_schuster(s)
+        assert list(longest_previous_factor(s)) == naive_lpf(s)
+
+def test_lz76_periodic():
+    assert lz76(np.zeros(1000, dtype=int)) == 2
+    assert lz76(np.tile([0, 1, 2], 1000)) == 4
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from edgestore import edge_records, read_edges, write_edges, EdgeWriter
+
+BIG = (1 << 33) | 5
+
+def test_edge_records_wide_configs():
+    edges = edge_records([BIG, (1 << 62) + 1], [7, BIG], [0.5, 1.0])
+    assert list(edges['from']) == [BIG, (1 << 62) + 1]
+    assert list(edges['to']) == [7, BIG]
+
+@pytest.mark.parametrize('ext', ['.txt', '.npy', '.edges'])
+def test_roundtrip_wide_configs(tmp_path, ext):
+    src = np.array([BIG, BIG, BIG, 3], dtype=np.uint64)
+    dst = np.array([BIG + 1, BIG + 1, BIG + 1, (1 << 62) + 9], dtype=np.uint64)
+    phi = np.array([0.0, 0.5, 1.0, 0.25])
+    filename = str(tmp_path / ('edgelist' + ext))
+    write_edges(filename, edge_records(src, dst, phi))
+
+    edges = read_edges(filename)
+    assert np.array_equal(edges['from'], src)
+    assert np.array_equal(edges['to'], dst)
+    assert np.allclose(edges['phi'], phi)
+
+def test_writer_appends_wide_configs(tmp_path):
+    filename = str(tmp_path / 'edgelist.edges')
+    writer = EdgeWriter(filename)
+    writer.append(np.full(2, BIG), [1, 2], [0.0, 1.0])
+    writer.close()
+    assert list(read_edges(filename)['from']) == [BIG, BIG]
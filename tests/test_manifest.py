@@ -0,0 +1,15 @@
+from manifest import Manifest
+
+def test_query_numeric_string_params(tmp_path):
+    manifest = Manifest(str(tmp_path / 'run_info.db'))
+    jobs = [(i, 0, 't.{:06d}.mx3'.format(i), {'B': 0.1 * i, 'Ku': '2e5', 'name': 'x', 'n': str(i)}, None)
+            for i in range(4)]
+    manifest.add_jobs(jobs)
+    assert manifest.query(B=(0.15, 0.25)) == [(2, 0)]
+    assert manifest.query(Ku=(1e5, 3e5)) == [(i, 0) for i in range(4)]
+    assert manifest.query(n=(1, 2)) == [(1, 0), (2, 0)]
+    assert manifest.query(n='3') == [(3, 0)]
+    assert manifest.query(name='x') == [(i, 0) for i in range(4)]
+    # Parameters keep the values they were given
+    assert manifest.get_job(1, 0)['params']['n'] == '1'
+    manifest.close()
@@ -0,0 +1,28 @@
+import os
+import numpy as np
+from mx3util import RunInfo
+
+def test_iter_tables_manifest_pool(manifest_sweep):
+    run = RunInfo(manifest_sweep(), load=True)
+    tables = list(run.iter_tables(['mx'], processes=2))
+    assert [(i, j) for i, j, _ in tables] == [(i, j) for i in range(3) for j in range(2)]
+    for i, j, X in tables:
+        assert np.all(X == 10 * i + j)
+
+def test_iter_tables_missing(manifest_sweep):
+    filename = manifest_sweep(runs=2, repeats=1)
+    os.remove(os.path.join(os.path.dirname(filename), 't.000001.000000.out', 'table.txt'))
+    run = RunInfo(filename, load=True)
+    tables = {(i, j): X for i, j, X in run.iter_tables(['mx'], processes=2, ordered=False)}
+    assert tables[(1, 0)] is None
+    assert np.all(tables[(0, 0)] == 0)
+
+def test_iter_table_chunks_window(tmp_path):
+    from conftest import write_table
+    from mx3util import iter_table_chunks
+    filename = str(tmp_path / 'run.out' / 'table.txt')
+    X = np.column_stack([np.arange(5000), np.arange(5000) * 2, np.zeros(5000), np.ones(5000)])
+    write_table(filename, X)
+    chunks = list(iter_table_chunks(filename, ['mx'], chunk_rows=700, cache=False, start=1234, stop=4321))
+    assert max(len(c) for c in chunks) == 700
+    assert np.array_equal(np.concatenate(chunks)[:,0], X[1234:4321, 1])
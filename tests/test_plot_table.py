@@ -0,0 +1,35 @@
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from conftest import write_table
+import plot_table
+
+def test_zoom_reads_visible_rows(tmp_path, monkeypatch):
+    n = 200000
+    t = np.arange(n) * 1e-12
+    filename = str(tmp_path / 'run.out' / 'table.txt')
+    write_table(filename, np.column_stack([t, np.sin(t * 1e10), np.zeros(n), np.zeros(n)]))
+
+    reads = []
+    iter_table_chunks = plot_table.iter_table_chunks
+    def spy(*args, **kwargs):
+        reads.append((kwargs['start'], kwargs['stop']))
+        return iter_table_chunks(*args, **kwargs)
+    monkeypatch.setattr(plot_table, 'iter_table_chunks', spy)
+
+    fig, ax = plt.subplots()
+    lines = plot_table.TableLines(filename, ['t', 'mx'], lambda X: X)
+    line = lines.plot(ax, 1)
+    lines.load(ax)
+    assert reads == [(0, n)]
+    assert len(line.get_xdata()) < 2000
+
+    ax.callbacks.connect('xlim_changed', lines.update)
+    ax.set_xlim(1e-7, 1.01e-7)
+    start, stop = reads[-1]
+    # The visible rows and a little margin
+    assert start <= 100000 and stop >= 101000 and stop - start < 5000
+    x = line.get_xdata()
+    assert x.min() <= 1e-7 and x.max() >= 1.01e-7
+    plt.close(fig)
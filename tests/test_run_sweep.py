@@ -0,0 +1,32 @@
+import os
+import sys
+import sqlite3
+import subprocess
+from conftest import ROOT
+
+def run_sweep(cwd, *args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.check_output([sys.executable, os.path.join(ROOT, 'run_sweep.py'), '-r', 'none',
+                                   '-s', 'B=arange(0, 3)', 't.mx3', 'out'] + list(args),
+                                  cwd=cwd, env=env)
+    return out.decode()
+
+def test_resume_requires_manifest_record(tmp_path):
+    with open(str(tmp_path / 't.mx3'), 'w') as f:
+        f.write("// B={{B}}\n")
+    run_sweep(str(tmp_path))
+
+    # Tables of all jobs, but only job 0 is known to have finished
+    for i in range(3):
+        outdir = tmp_path / 'out' / 't.{:06d}.out'.format(i)
+        outdir.mkdir()
+        (outdir / 'table.txt').write_text("# t (s)\tmx ()\n0\t1\n")
+    db = sqlite3.connect(str(tmp_path / 'out' / 'run_info.db'))
+    with db:
+        db.execute("UPDATE jobs SET status = 'finished' WHERE run_index = 0")
+        db.execute("DELETE FROM params WHERE job_id IN (SELECT id FROM jobs WHERE run_index = 2)")
+        db.execute("DELETE FROM jobs WHERE run_index = 2")
+    db.close()
+
+    out = run_sweep(str(tmp_path), '--resume')
+    assert "Resume: 1 of 3 jobs already complete" in out
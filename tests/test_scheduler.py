@@ -0,0 +1,63 @@
+import os
+import subprocess
+import pytest
+from scheduler import slurm_job_active, array_tasks, SlurmArray
+
+def fake_command(tmp_path, name, script):
+    """ Executable shell script standing in for a Slurm command """
+    filename = str(tmp_path / name)
+    with open(filename, 'w') as f:
+        f.write("#!/bin/sh\n" + script)
+    os.chmod(filename, 0o755)
+    return filename
+
+def test_slurm_job_active_running(tmp_path):
+    squeue = fake_command(tmp_path, 'squeue', 'echo 12\n')
+    assert slurm_job_active(12, squeue)
+
+def test_slurm_job_active_gone(tmp_path):
+    squeue = fake_command(tmp_path, 'squeue',
+            'echo "slurm_load_jobs error: Invalid job id specified" >&2\nexit 1\n')
+    assert not slurm_job_active(12, squeue)
+
+def test_slurm_job_active_retries(tmp_path):
+    # Fails once, then lists the job
+    marker = str(tmp_path / 'failed')
+    squeue = fake_command(tmp_path, 'squeue',
+            'if [ ! -e {0} ]; then touch {0}; echo "Socket timed out" >&2; exit 1; fi\n'
+            'echo 12\n'.format(marker))
+    assert slurm_job_active(12, squeue, retry_interval=0)
+
+def test_slurm_job_active_error(tmp_path):
+    squeue = fake_command(tmp_path, 'squeue', 'echo "Socket timed out" >&2\nexit 1\n')
+    with pytest.raises(subprocess.CalledProcessError):
+        slurm_job_active(12, squeue, retries=1, retry_interval=0)
+
+def test_array_tasks():
+    assert array_tasks('7') == [7]
+    assert array_tasks('[4-6,9%8]') == [4, 5, 6, 9]
+    assert array_tasks('[2-3]') == [2, 3]
+
+def cancelled_array(tmp_path):
+    """ Array of 6 tasks cancelled while tasks 2-5 were still pending """
+    sacct = fake_command(tmp_path, 'sacct',
+            'echo "123_0|COMPLETED|0:0"\n'
+            'echo "123_1|CANCELLED by 1000|0:15"\n'
+            'echo "123_[2-5%2]|CANCELLED by 1000|0:0"\n')
+    array = SlurmArray(['job{}.mx3'.format(i) for i in range(6)], str(tmp_path / 'job.slurm.sh'),
+                       sacct=sacct)
+    array.job_id = '123'
+    return array
+
+def test_query_sacct_pending_range(tmp_path):
+    states = cancelled_array(tmp_path).query_sacct()
+    assert states[0] == ('COMPLETED', 0)
+    assert states[1] == ('CANCELLED', 0)
+    assert all(states[t] == ('CANCELLED', 0) for t in range(2, 6))
+
+def test_wait_cancelled_array(tmp_path):
+    array = cancelled_array(tmp_path)
+    finished = []
+    array.wait(interval=0, on_finish=lambda jobs, state, exit_code: finished.extend(jobs))
+    assert array.pending == 0
+    assert sorted(finished) == ['job{}.mx3'.format(i) for i in range(6)]